@@ -1,24 +1,177 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, UpdateOne, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
+from pymongo import monitoring
 import os
+import sys
+import random
 import logging
+import asyncio
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, BeforeValidator, PlainSerializer, ValidationError, TypeAdapter
+from typing import List, Optional, Annotated, Union, get_args, get_origin
 import uuid
+import time
+import json
+import base64
+import re
+import io
+import csv
+import tempfile
+import hashlib
+import binascii
+from collections import OrderedDict, deque
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 import jwt
 
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas as pdf_canvas
+except ImportError:
+    pdf_canvas = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+# In-process counters/histograms rendered in the Prometheus text format at
+# /metrics, which needs METRICS_TOKEN. Mongo commands are labelled with the route
+# that issued them; Motor copies the context into its executor threads, so the
+# command listener can read request_scope.
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+request_scope = contextvars.ContextVar("request_scope", default=None)
+
+def _metric_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+class MetricsRegistry:
+    def __init__(self, buckets: tuple = METRIC_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.meta = {}
+        self.values = {}
+
+    def _series(self, kind: str, name: str, help_text: str) -> dict:
+        if name not in self.meta:
+            self.meta[name] = (kind, help_text)
+            self.values[name] = {}
+        return self.values[name]
+
+    def inc(self, name: str, help_text: str, labels: tuple, amount: float = 1):
+        with self.lock:
+            series = self._series("counter", name, help_text)
+            series[labels] = series.get(labels, 0) + amount
+
+    def add(self, name: str, help_text: str, labels: tuple, amount: float):
+        with self.lock:
+            series = self._series("gauge", name, help_text)
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name: str, help_text: str, labels: tuple, value: float):
+        with self.lock:
+            series = self._series("histogram", name, help_text)
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (kind, help_text) in sorted(self.meta.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(self.values[name].items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_metric_labels(labels)} {value}")
+                        continue
+                    counts, total, count = value
+                    for bound, bucket_count in zip(self.buckets, counts):
+                        lines.append(f"{name}_bucket{_metric_labels(labels + (('le', bound),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{_metric_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_metric_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_metric_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+def current_route() -> str:
+    scope = request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self.pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        self.pending[event.request_id] = (current_route(), collection if isinstance(collection, str) else "-")
+
+    def succeeded(self, event):
+        route, collection = self.pending.pop(event.request_id, (current_route(), "-"))
+        labels = (("route", route), ("collection", collection), ("command", event.command_name))
+        self.registry.observe("sanacare_mongo_command_duration_seconds", "Mongo command duration", labels, event.duration_micros / 1e6)
+        reply = event.reply
+        cursor = reply.get("cursor")
+        if isinstance(cursor, dict):
+            documents = len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+        elif "values" in reply:
+            documents = len(reply["values"])
+        elif "value" in reply:
+            documents = 1 if reply["value"] else 0
+        else:
+            documents = reply.get("n", 0)
+        self.registry.inc("sanacare_mongo_command_documents_total", "Documents returned or written by Mongo commands", labels, documents)
+
+    def failed(self, event):
+        route, collection = self.pending.pop(event.request_id, (current_route(), "-"))
+        labels = (("route", route), ("collection", collection), ("command", event.command_name))
+        self.registry.observe("sanacare_mongo_command_duration_seconds", "Mongo command duration", labels, event.duration_micros / 1e6)
+        self.registry.inc("sanacare_mongo_command_failures_total", "Failed Mongo commands", labels)
+
+mongo_metrics = MongoCommandMetrics(metrics)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[mongo_metrics])
 db = client[os.environ['DB_NAME']]
 
 # Security
@@ -31,6 +184,46 @@ ALGORITHM = "HS256"
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
+# Dates
+# Dates are stored as BSON dates in UTC. The API still accepts and returns ISO
+# strings, so models parse either form and serialize back to strings.
+def to_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.strip())
+        return parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    raise ValueError(f"Invalid date: {value!r}")
+
+Timestamp = Annotated[datetime, BeforeValidator(to_datetime), PlainSerializer(lambda v: v.isoformat(), return_type=str, when_used="json")]
+DateOnly = Annotated[datetime, BeforeValidator(to_datetime), PlainSerializer(lambda v: v.date().isoformat(), return_type=str, when_used="json")]
+# Stored dates the migration could not parse are passed through unchanged
+StoredDate = Annotated[Union[DateOnly, str], Field(union_mode="left_to_right")]
+
+def day_key(value) -> str:
+    return to_datetime(value).date().isoformat()
+
+def period_range(period: str) -> tuple:
+    if not re.fullmatch(r"\d{4}-\d{2}", period):
+        raise HTTPException(status_code=400, detail="Period must be YYYY-MM")
+    year, month = int(period[:4]), int(period[5:])
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="Period must be YYYY-MM")
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+def schedule_window(date, start_time: str, end_time: str) -> tuple:
+    day = to_datetime(date).replace(hour=0, minute=0, second=0, microsecond=0)
+    start_hour, start_minute = start_time.split(":")[:2]
+    end_hour, end_minute = end_time.split(":")[:2]
+    starts_at = day + timedelta(hours=int(start_hour), minutes=int(start_minute))
+    ends_at = day + timedelta(hours=int(end_hour), minutes=int(end_minute))
+    # Night shifts end the next day
+    if ends_at <= starts_at:
+        ends_at += timedelta(days=1)
+    return starts_at, ends_at
+
 # Models
 class UserBase(BaseModel):
     email: EmailStr
@@ -48,8 +241,9 @@ class UserCreate(UserBase):
 class User(UserBase):
     model_config = ConfigDict(extra="ignore")
     id: str
+    photo_thumb: Optional[str] = None
     status: str  # pending, approved, rejected
-    created_at: str
+    created_at: Timestamp
 
 class UserLogin(BaseModel):
     email: EmailStr
@@ -59,6 +253,11 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     user: User
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class Institution(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -67,7 +266,7 @@ class Institution(BaseModel):
     address: str
     phone: str
     email: Optional[str] = None
-    created_at: str
+    created_at: Timestamp
 
 class InstitutionCreate(BaseModel):
     name: str
@@ -80,41 +279,86 @@ class Schedule(BaseModel):
     id: str
     user_id: str
     institution_id: str
-    date: str
+    date: StoredDate
     start_time: str
     end_time: str
     status: str  # available, booked, completed
-    created_at: str
+    starts_at: Optional[Timestamp] = None
+    ends_at: Optional[Timestamp] = None
+    template_id: Optional[str] = None
+    created_at: Timestamp
 
 class ScheduleCreate(BaseModel):
     user_id: str
     institution_id: str
-    date: str
+    date: DateOnly
+    start_time: str
+    end_time: str
+    status: str = "available"
+
+class TimeRange(BaseModel):
     start_time: str
     end_time: str
+
+class ScheduleTemplateCreate(BaseModel):
+    user_id: str
+    institution_id: str
+    weekdays: List[int]  # 0 = Monday ... 6 = Sunday
+    slots: List[TimeRange]
+    starts_on: DateOnly
+    ends_on: Optional[DateOnly] = None
+    exceptions: List[DateOnly] = []
     status: str = "available"
 
+class ScheduleTemplate(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    user_id: str
+    institution_id: str
+    weekdays: List[int]
+    slots: List[TimeRange]
+    starts_on: StoredDate
+    ends_on: Optional[StoredDate] = None
+    exceptions: List[StoredDate] = []
+    status: str
+    expanded_until: StoredDate
+    created_at: Timestamp
+
+class Availability(BaseModel):
+    user_id: str
+    first_name: str
+    last_name: str
+    role: str
+    schedule_id: str
+    institution_id: str
+    starts_at: Timestamp
+    ends_at: Timestamp
+
 class Shift(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str
     user_id: str
     institution_id: str
-    date: str
+    date: StoredDate
     hours: float
     hourly_rate: float
     travel_cost: float
     total: float
     status: str  # pending, validated, paid
-    created_at: str
+    created_at: Timestamp
 
 class ShiftCreate(BaseModel):
     user_id: str
     institution_id: str
-    date: str
+    date: DateOnly
     hours: float
     hourly_rate: float
     travel_cost: float = 0.0
 
+class ShiftStatusBulk(BaseModel):
+    shift_ids: List[str]
+    status: str
+
 class Payslip(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str
@@ -124,7 +368,7 @@ class Payslip(BaseModel):
     gross_total: float
     commission: float  # 7%
     net_total: float
-    created_at: str
+    created_at: Timestamp
 
 class Message(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -132,20 +376,29 @@ class Message(BaseModel):
     sender_id: str
     recipient_id: str
     content: str
-    timestamp: str
+    timestamp: Timestamp
     read: bool = False
 
 class MessageCreate(BaseModel):
     recipient_id: str
     content: str
 
+class Conversation(BaseModel):
+    id: str
+    other_user_id: str
+    last_message_id: str
+    last_sender_id: str
+    last_message: str
+    last_activity: Timestamp
+    unread_count: int = 0
+
 class Notification(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str
     user_id: str
     type: str
     content: str
-    timestamp: str
+    timestamp: Timestamp
     read: bool = False
 
 class ShiftExchange(BaseModel):
@@ -155,7 +408,7 @@ class ShiftExchange(BaseModel):
     to_user_id: str
     shift_id: str
     status: str  # pending, accepted, rejected
-    created_at: str
+    created_at: Timestamp
 
 class ShiftExchangeCreate(BaseModel):
     to_user_id: str
@@ -168,37 +421,1344 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
-def create_access_token(data: dict) -> str:
-    to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(days=7)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+class WorkerPool:
+    # Runs CPU-bound work off the event loop; rejects with 503 once workers and queue are full
+    def __init__(self, name: str, workers: int, max_queue: int, use_processes: bool = False):
+        if use_processes:
+            # Spawned rather than forked: workers start lazily, after the Mongo client's
+            # monitor threads are running, and PyMongo is not fork-safe
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args, admit: bool = True):
+        # admit=False waits for a worker instead of being turned away (bulk jobs that pace themselves)
+        if admit and self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def map(self, fn, items: list) -> list:
+        # At most one item per worker in flight, so bulk jobs leave the queue to interactive requests
+        results = []
+        for offset in range(0, len(items), self.workers):
+            batch = items[offset:offset + self.workers]
+            results.extend(await asyncio.gather(*(self.run(fn, item, admit=False) for item in batch)))
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "rejected": self.rejected
+        }
+
+class PasswordWorkerPool(WorkerPool):
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+password_pool = PasswordWorkerPool(
+    "password",
+    workers=int(os.environ.get('PASSWORD_WORKERS', '4')),
+    max_queue=int(os.environ.get('PASSWORD_QUEUE_SIZE', '64')),
+    use_processes=os.environ.get('PASSWORD_EXECUTOR', 'thread') == 'process'
+)
+
+# Tokens
+# Access tokens are short-lived and carry the claims routes authorize on, so
+# with AUTH_TOKEN_MODE=claims (opt-in) a request needs no user lookup; the default
+# "lookup" mode still loads the user through principal_cache. Refresh tokens
+# are checked against the user document. Every token carries the user's
+# token_version; bumping it (status, claim or password changes) revokes the
+# older tokens: refresh tokens at once, access tokens through TokenRevocations
+# in this process and, elsewhere, when they expire.
+AUTH_TOKEN_MODE = os.environ.get('AUTH_TOKEN_MODE', 'lookup')
+ACCESS_TOKEN_MINUTES = int(os.environ.get('ACCESS_TOKEN_MINUTES', '15'))
+REFRESH_TOKEN_DAYS = int(os.environ.get('REFRESH_TOKEN_DAYS', '7'))
+TOKEN_CLAIM_FIELDS = ["email", "first_name", "last_name", "role", "status", "institution_id"]
+
+def issue_tokens(user: dict) -> dict:
+    now = datetime.now(timezone.utc)
+    version = user.get("token_version", 0)
+    access = {
+        "sub": user["id"],
+        "typ": "access",
+        "ver": version,
+        "created_at": to_datetime(user["created_at"]).isoformat(),
+        "exp": now + timedelta(minutes=ACCESS_TOKEN_MINUTES),
+        **{field: user.get(field) for field in TOKEN_CLAIM_FIELDS}
+    }
+    refresh = {"sub": user["id"], "typ": "refresh", "ver": version, "exp": now + timedelta(days=REFRESH_TOKEN_DAYS)}
+    return {
+        "access_token": jwt.encode(access, SECRET_KEY, algorithm=ALGORITHM),
+        "refresh_token": jwt.encode(refresh, SECRET_KEY, algorithm=ALGORITHM),
+        "expires_in": ACCESS_TOKEN_MINUTES * 60
+    }
+
+class TokenRevocations:
+    # Lowest token_version still accepted per user. An entry is only needed until
+    # every access token issued before the bump has expired, then it is pruned.
+    def __init__(self, lifetime: float):
+        self.lifetime = lifetime
+        self._versions = {}
+        self.rejected = 0
+
+    def revoke(self, user_id: str, version: int):
+        current = self._versions.get(user_id)
+        if current is None or version > current[0]:
+            self._versions[user_id] = (version, time.monotonic() + self.lifetime)
+
+    def is_revoked(self, user_id: str, version: int) -> bool:
+        entry = self._versions.get(user_id)
+        if entry is None:
+            return False
+        if entry[1] <= time.monotonic():
+            del self._versions[user_id]
+            return False
+        if version < entry[0]:
+            self.rejected += 1
+            return True
+        return False
+
+    def stats(self) -> dict:
+        return {"entries": len(self._versions), "rejected": self.rejected}
+
+token_revocations = TokenRevocations(lifetime=ACCESS_TOKEN_MINUTES * 60)
+
+async def revoke_tokens(user_id: str):
+    await db.users.update_one({"id": user_id}, {"$inc": {"token_version": 1}})
+    after = await db.users.find_one({"id": user_id}, {"_id": 0, "token_version": 1})
+    if after is not None:
+        token_revocations.revoke(user_id, after["token_version"])
+    principal_cache.invalidate(user_id)
+
+class PrincipalCache:
+    # Bounded TTL + LRU cache of validated User principals keyed by user id
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str) -> Optional[User]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return user
+
+    def put(self, user: User):
+        if self.max_size <= 0:
+            return
+        self._entries[user.id] = (user, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: str):
+        if self._entries.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+principal_cache = PrincipalCache(
+    max_size=int(os.environ.get('PRINCIPAL_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('PRINCIPAL_CACHE_TTL', '60'))
+)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
+
+async def authenticate_token(token: str) -> User:
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = payload.get("sub")
-        if user_id is None:
+        if user_id is None or payload.get("typ") == "refresh":
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        if payload.get("typ") == "access":
+            if token_revocations.is_revoked(user_id, payload["ver"]):
+                raise HTTPException(status_code=401, detail="Token revoked")
+            if AUTH_TOKEN_MODE == "claims":
+                # Signed by us, so skip validation; fields not in the token keep their defaults
+                return User.model_construct(
+                    id=user_id,
+                    created_at=to_datetime(payload["created_at"]),
+                    **{field: payload.get(field) for field in TOKEN_CLAIM_FIELDS}
+                )
+        cached = principal_cache.get(user_id)
+        if cached is not None:
+            return cached
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
-        return User(**user)
+        principal = User(**user)
+        principal_cache.put(principal)
+        return principal
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
+    except HTTPException:
+        raise
     except:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-async def create_notification(user_id: str, notification_type: str, content: str):
-    notification = {
+# Read notifications are dropped NOTIFICATION_RETENTION_DAYS after being read,
+# by a TTL index or, with NOTIFICATION_ARCHIVE, moved to notifications_archive.
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', '30'))
+NOTIFICATION_ARCHIVE = os.environ.get('NOTIFICATION_ARCHIVE', '').lower() in ('1', 'true', 'yes')
+NOTIFICATION_TTL = NOTIFICATION_RETENTION_DAYS > 0 and not NOTIFICATION_ARCHIVE
+
+# Sync entries older than this are dropped; clients holding an older cursor reload in full
+SYNC_RETENTION_DAYS = int(os.environ.get('SYNC_RETENTION_DAYS', '30'))
+
+# Indexes
+# Every route looks documents up by our own "id" field or by owner/date fields,
+# so each query shape below needs a matching index to avoid collection scans.
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("role", ASCENDING)], name="role"),
+        IndexModel([("status", ASCENDING)], name="status"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+    ],
+    "institutions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+    ],
+    "schedules": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], name="user_date"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_at_id"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("institution_id", ASCENDING), ("status", ASCENDING), ("starts_at", ASCENDING), ("ends_at", ASCENDING)], name="institution_status_window"),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING), ("starts_at", ASCENDING)], name="user_status_starts_at"),
+        IndexModel([("template_id", ASCENDING), ("date", ASCENDING)], name="template_date"),
+    ],
+    "schedule_templates": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_at_id"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel([("finished", ASCENDING), ("expanded_until", ASCENDING)], name="finished_expanded_until"),
+    ],
+    "shifts": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING), ("date", ASCENDING)], name="user_status_date"),
+        IndexModel([("status", ASCENDING)], name="status"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_at_id"),
+        IndexModel([("institution_id", ASCENDING), ("date", ASCENDING)], name="institution_date"),
+        IndexModel([("date", ASCENDING)], name="date"),
+    ],
+    "payslips": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("period", ASCENDING)], name="user_period"),
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_at_id"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+    ],
+    "messages": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("sender_id", ASCENDING), ("recipient_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)], name="sender_recipient_timestamp_id"),
+        IndexModel([("sender_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)], name="sender_timestamp_id"),
+        IndexModel([("recipient_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)], name="recipient_timestamp_id"),
+        IndexModel([("recipient_id", ASCENDING), ("read", ASCENDING)], name="recipient_read"),
+    ],
+    "notifications": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)], name="user_timestamp"),
+        # Same name in both modes; ensure_indexes switches the TTL on or off in place
+        IndexModel([("read_at", ASCENDING)], name="read_at", expireAfterSeconds=NOTIFICATION_RETENTION_DAYS * 86400)
+        if NOTIFICATION_TTL else IndexModel([("read_at", ASCENDING)], name="read_at"),
+    ],
+    "notifications_archive": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)], name="user_timestamp"),
+    ],
+    "notification_counters": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "shift_exchanges": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("from_user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="from_user_created_at_id"),
+        IndexModel([("to_user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="to_user_created_at_id"),
+    ],
+    "dashboard_counters": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "versions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "sync_changes": [
+        IndexModel([("seq", ASCENDING)], name="seq_unique", unique=True),
+        IndexModel([("users", ASCENDING), ("seq", ASCENDING)], name="users_seq"),
+        IndexModel([("at", ASCENDING)], name="at_ttl", expireAfterSeconds=SYNC_RETENTION_DAYS * 86400),
+    ],
+    "conversations": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("participants", ASCENDING), ("last_activity", DESCENDING), ("id", DESCENDING)], name="participants_last_activity"),
+    ],
+    "migrations": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "payroll_runs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+    "payroll_locks": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+}
+
+# Representative query shapes issued by the routes, checked by the explain audit.
+# Paged shapes (sorted on a field then id) are also checked with an after= cursor.
+AUDIT_QUERIES = [
+    ("users", {"id": "x"}, None),
+    ("users", {"email": "x@example.com"}, None),
+    ("users", {"role": "admin"}, None),
+    ("users", {"status": "pending"}, None),
+    ("users", {}, {"created_at": 1, "id": 1}),
+    ("institutions", {"id": "x"}, None),
+    ("institutions", {}, {"created_at": 1, "id": 1}),
+    ("schedules", {"user_id": "x"}, {"created_at": 1, "id": 1}),
+    ("schedules", {}, {"created_at": 1, "id": 1}),
+    ("schedules", {"institution_id": "x", "status": "available", "starts_at": {"$gte": datetime(2025, 1, 1), "$lte": datetime(2025, 1, 2)}, "ends_at": {"$gte": datetime(2025, 1, 2)}}, None),
+    ("schedules", {"user_id": {"$in": ["x"]}, "status": "booked", "starts_at": {"$gt": datetime(2025, 1, 1), "$lt": datetime(2025, 1, 2)}}, None),
+    ("schedules", {"template_id": "x", "date": {"$gte": datetime(2025, 1, 1)}}, None),
+    ("schedule_templates", {"finished": {"$in": [False, None]}, "expanded_until": {"$lt": datetime(2025, 1, 1)}}, None),
+    ("shifts", {"id": "x"}, None),
+    ("shifts", {"user_id": "x"}, {"created_at": 1, "id": 1}),
+    ("shifts", {"user_id": "x", "status": "validated", "date": {"$gte": datetime(2025, 1, 1), "$lt": datetime(2025, 2, 1)}}, None),
+    ("shifts", {"status": "pending"}, None),
+    ("shifts", {"created_at": {"$gte": datetime(2025, 1, 1)}}, None),
+    ("payslips", {"user_id": "x"}, {"created_at": 1, "id": 1}),
+    ("payslips", {}, {"created_at": 1, "id": 1}),
+    ("messages", {"$or": [{"sender_id": "x", "recipient_id": "y"}, {"sender_id": "y", "recipient_id": "x"}]}, {"timestamp": 1, "id": 1}),
+    ("messages", {"$or": [{"sender_id": "x"}, {"recipient_id": "x"}]}, {"timestamp": 1, "id": 1}),
+    ("messages", {"id": "x", "recipient_id": "y"}, None),
+    ("messages", {"recipient_id": "x", "read": False}, None),
+    ("conversations", {"participants": "x"}, {"last_activity": -1, "id": -1}),
+    ("notifications", {"user_id": "x"}, {"timestamp": -1}),
+    ("notifications", {"id": "x", "user_id": "y"}, None),
+    ("shift_exchanges", {"id": "x"}, None),
+    ("shift_exchanges", {"$or": [{"from_user_id": "x"}, {"to_user_id": "x"}]}, {"created_at": 1, "id": 1}),
+    ("sync_changes", {"users": {"$in": ["x", "*"]}, "seq": {"$gt": 0}}, {"seq": 1}),
+]
+
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+def _index_spec(keys) -> list:
+    return [(field, int(direction)) for field, direction in keys]
+
+async def ensure_indexes(create: bool = True) -> dict:
+    report = {"missing": {}, "created": {}, "dropped": {}, "failed": {}, "drift": {}}
+    for collection, declared in INDEXES.items():
+        existing = await db[collection].index_information()
+        missing = []
+        ttl_changes = []
+        for index in declared:
+            doc = index.document
+            current = existing.get(doc["name"])
+            if current is None:
+                missing.append(index)
+            elif _index_spec(current["key"]) != _index_spec(doc["key"].items()) or current.get("unique", False) != doc.get("unique", False):
+                report["drift"].setdefault(collection, []).append({"name": doc["name"], "issue": "definition differs"})
+            elif current.get("expireAfterSeconds") != doc.get("expireAfterSeconds"):
+                ttl_changes.append(doc)
+        
+        # An undeclared index on the keys of a missing one (e.g. renamed) would block
+        # creating it, so it is replaced
+        declared_names = {index.document["name"] for index in declared}
+        superseded = {}
+        for name, info in existing.items():
+            if name == "_id_" or name in declared_names:
+                continue
+            replacement = next((index.document["name"] for index in missing if _index_spec(info["key"]) == _index_spec(index.document["key"].items())), None)
+            if replacement:
+                superseded[name] = replacement
+            else:
+                report["drift"].setdefault(collection, []).append({"name": name, "issue": "not declared"})
+        
+        if not create:
+            if missing:
+                report["missing"][collection] = [index.document["name"] for index in missing]
+            for doc in ttl_changes:
+                report["drift"].setdefault(collection, []).append({"name": doc["name"], "issue": "expireAfterSeconds differs"})
+            for name, replacement in superseded.items():
+                report["drift"].setdefault(collection, []).append({"name": name, "issue": f"superseded by {replacement}"})
+            continue
+        
+        for name in superseded:
+            try:
+                await db[collection].drop_index(name)
+                report["dropped"].setdefault(collection, []).append(name)
+            except OperationFailure as e:
+                report["failed"].setdefault(collection, []).append({"name": name, "error": str(e)})
+        
+        # A changed retention period only needs the TTL updated in place; collMod
+        # can't remove a TTL though, so that index is dropped and built again
+        for doc in ttl_changes:
+            try:
+                if "expireAfterSeconds" in doc:
+                    await db.command("collMod", collection, index={"name": doc["name"], "expireAfterSeconds": doc["expireAfterSeconds"]})
+                    report["created"].setdefault(collection, []).append(doc["name"])
+                else:
+                    await db[collection].drop_index(doc["name"])
+                    report["dropped"].setdefault(collection, []).append(doc["name"])
+                    missing.extend(index for index in declared if index.document["name"] == doc["name"])
+            except OperationFailure as e:
+                report["failed"].setdefault(collection, []).append({"name": doc["name"], "error": str(e)})
+        # Create one by one so a single failure (e.g. duplicate emails) doesn't block the others
+        for index in missing:
+            name = index.document["name"]
+            try:
+                await db[collection].create_indexes([index])
+                report["created"].setdefault(collection, []).append(name)
+            except OperationFailure as e:
+                report["failed"].setdefault(collection, []).append({"name": name, "error": str(e)})
+    return report
+
+def _audit_shapes():
+    for collection, query, sort in AUDIT_QUERIES:
+        yield collection, query, sort
+        if sort and list(sort)[-1] == "id" and len(sort) == 2:
+            field, direction = next(iter(sort.items()))
+            yield collection, keyset_query(query, field, datetime(2025, 1, 1), "x", direction), sort
+
+async def explain_audit() -> list:
+    # Collection scans and blocking in-memory sorts both mean a missing index
+    findings = []
+    for collection, query, sort in _audit_shapes():
+        command = {"find": collection, "filter": query}
+        if sort:
+            command["sort"] = sort
+        explain = await db.command({"explain": command, "verbosity": "queryPlanner"})
+        stages = set(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+        for stage in ("COLLSCAN", "SORT"):
+            if stage in stages:
+                findings.append({"stage": stage, "collection": collection, "filter": query, "sort": sort})
+    return findings
+
+# Date migration
+# Converts legacy ISO string dates to BSON dates in batches. Progress is
+# checkpointed per collection so an interrupted run resumes where it stopped.
+DATE_FIELDS = {
+    "users": ["created_at"],
+    "institutions": ["created_at"],
+    "schedules": ["date", "created_at"],
+    "shifts": ["date", "created_at"],
+    "payslips": ["created_at"],
+    "messages": ["timestamp"],
+    "notifications": ["timestamp"],
+    "shift_exchanges": ["created_at"],
+}
+DATE_MIGRATION_ID = "native_dates"
+DATE_MIGRATION_BATCH_SIZE = int(os.environ.get('DATE_MIGRATION_BATCH_SIZE', '1000'))
+
+def _date_updates(collection: str, doc: dict) -> dict:
+    updates = {field: to_datetime(doc[field]) for field in DATE_FIELDS[collection] if isinstance(doc.get(field), str)}
+    if collection == "schedules" and "starts_at" not in doc:
+        updates["starts_at"], updates["ends_at"] = schedule_window(updates.get("date", doc["date"]), doc["start_time"], doc["end_time"])
+    return updates
+
+async def _migrate_collection(collection: str, progress: dict):
+    fields = DATE_FIELDS[collection]
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field: 1 for field in fields}
+    if collection == "schedules":
+        query["$or"].append({"starts_at": {"$exists": False}})
+        projection.update({"start_time": 1, "end_time": 1, "starts_at": 1})
+    
+    while True:
+        page_query = {**query, "_id": {"$gt": progress["last_id"]}} if progress["last_id"] else query
+        docs = await db[collection].find(page_query, projection).sort("_id", 1).limit(DATE_MIGRATION_BATCH_SIZE).to_list(DATE_MIGRATION_BATCH_SIZE)
+        if not docs:
+            break
+        operations = []
+        for doc in docs:
+            try:
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": _date_updates(collection, doc)}))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                progress["failed"] += 1
+        if operations:
+            await db[collection].bulk_write(operations, ordered=False)
+        progress["converted"] += len(operations)
+        progress["last_id"] = docs[-1]["_id"]
+        await db.migrations.update_one({"id": DATE_MIGRATION_ID}, {"$set": {f"collections.{collection}": progress}}, upsert=True)
+    
+    progress["done"] = True
+    await db.migrations.update_one({"id": DATE_MIGRATION_ID}, {"$set": {f"collections.{collection}": progress}}, upsert=True)
+
+async def migrate_dates(restart: bool = False) -> dict:
+    state = None if restart else await db.migrations.find_one({"id": DATE_MIGRATION_ID}, {"_id": 0})
+    collections = (state or {}).get("collections", {})
+    for collection in DATE_FIELDS:
+        progress = collections.setdefault(collection, {"converted": 0, "failed": 0, "last_id": None, "done": False})
+        if not progress["done"]:
+            await _migrate_collection(collection, progress)
+    
+    # Conversation summaries copy message timestamps, so rebuild them from the migrated messages
+    if await db.conversations.find_one({"last_activity": {"$type": "string"}}, {"_id": 1}):
+        await rebuild_conversations()
+    
+    await db.migrations.update_one(
+        {"id": DATE_MIGRATION_ID},
+        {"$set": {"collections": collections, "completed_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    return date_migration_report(collections)
+
+def date_migration_report(collections: dict) -> dict:
+    return {
+        collection: {k: v for k, v in progress.items() if k != "last_id"}
+        for collection, progress in collections.items()
+    }
+
+# Photos
+# Profile photos live in a content-addressed directory instead of inline data
+# URLs on the user document; users only keep the /api/photos/... URLs.
+PHOTO_DIR = Path(os.environ.get('PHOTO_STORAGE_DIR', str(ROOT_DIR / 'uploads' / 'photos')))
+PHOTO_MAX_BYTES = int(os.environ.get('PHOTO_MAX_BYTES', str(5 * 1024 * 1024)))
+PHOTO_THUMB_SIZE = int(os.environ.get('PHOTO_THUMB_SIZE', '128'))
+PHOTO_TYPES = {"image/jpeg": "jpg", "image/jpg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+PHOTO_MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+PHOTO_NAME = re.compile(r"^[0-9a-f]{64}(_thumb)?\.(jpg|png|gif|webp)$")
+DATA_URL = re.compile(r"^data:([\w/+.-]+);base64,(.*)$", re.DOTALL)
+
+PHOTO_ERRORS = (OSError, ValueError) + ((Image.DecompressionBombError,) if Image is not None else ())
+
+def _open_photo(data: bytes):
+    image = Image.open(io.BytesIO(data))
+    # Pillow only warns between one and two times this size; refuse before decoding
+    if image.width * image.height > (Image.MAX_IMAGE_PIXELS or float("inf")):
+        raise ValueError("Image dimensions too large")
+    return image
+
+def _render_thumb(data: bytes) -> bytes:
+    # verify() leaves the image unusable, so it is opened again to draw the thumbnail
+    _open_photo(data).verify()
+    image = ImageOps.exif_transpose(_open_photo(data))
+    image.thumbnail((PHOTO_THUMB_SIZE, PHOTO_THUMB_SIZE))
+    out = io.BytesIO()
+    image.convert("RGB").save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+def _write_photo(data: bytes, ext: str) -> tuple:
+    # Everything is decoded before the first write, so rejected uploads leave no files behind
+    thumb_data = _render_thumb(data) if Image is not None else data
+    
+    PHOTO_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256(data).hexdigest()
+    original = PHOTO_DIR / f"{digest}.{ext}"
+    if not original.exists():
+        original.write_bytes(data)
+    
+    thumb_ext = "jpg" if Image is not None else ext
+    thumb = PHOTO_DIR / f"{digest}_thumb.{thumb_ext}"
+    if not thumb.exists():
+        thumb.write_bytes(thumb_data)
+    return f"/api/photos/{original.name}", f"/api/photos/{thumb.name}"
+
+async def store_photo(data_url: str) -> tuple:
+    match = DATA_URL.match(data_url)
+    if not match or match.group(1).lower() not in PHOTO_TYPES:
+        raise HTTPException(status_code=400, detail="Photo must be a JPEG, PNG, GIF or WebP data URL")
+    try:
+        data = base64.b64decode(match.group(2), validate=True)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Invalid photo encoding")
+    if len(data) > PHOTO_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Photo too large")
+    try:
+        return await asyncio.to_thread(_write_photo, data, PHOTO_TYPES[match.group(1).lower()])
+    except PHOTO_ERRORS:
+        raise HTTPException(status_code=400, detail="Invalid image")
+
+async def migrate_inline_photos() -> int:
+    moved = 0
+    while True:
+        users = await db.users.find({"photo": {"$regex": "^data:"}}, {"_id": 0, "id": 1, "photo": 1}).limit(100).to_list(100)
+        if not users:
+            return moved
+        operations = []
+        for user in users:
+            try:
+                photo, photo_thumb = await store_photo(user["photo"])
+                operations.append(UpdateOne({"id": user["id"]}, {"$set": {"photo": photo, "photo_thumb": photo_thumb}}))
+            except HTTPException as e:
+                logger.warning(f"Dropping unreadable photo of user {user['id']}: {e.detail}")
+                operations.append(UpdateOne({"id": user["id"]}, {"$set": {"photo": None, "photo_thumb": None}}))
+            principal_cache.invalidate(user["id"])
+        await db.users.bulk_write(operations, ordered=False)
+        moved += len(operations)
+
+# Payslip PDFs
+# Rendered PDFs are cached on disk under a hash of everything printed on them,
+# so repeat downloads skip rendering and the hash doubles as the ETag. Cache hits
+# touch the file; a periodic sweep drops PDFs unused for PAYSLIP_PDF_MAX_AGE_DAYS
+# and then the least recently used ones above PAYSLIP_PDF_CACHE_MB.
+PAYSLIP_PDF_DIR = Path(os.environ.get('PAYSLIP_PDF_DIR', str(ROOT_DIR / 'uploads' / 'payslips')))
+PAYSLIP_PDF_LAYOUT = 1
+PAYSLIP_PDF_MAX_AGE_DAYS = float(os.environ.get('PAYSLIP_PDF_MAX_AGE_DAYS', '30'))
+PAYSLIP_PDF_CACHE_MB = float(os.environ.get('PAYSLIP_PDF_CACHE_MB', '512'))
+
+render_pool = WorkerPool(
+    "render",
+    workers=int(os.environ.get('RENDER_WORKERS', '2')),
+    max_queue=int(os.environ.get('RENDER_QUEUE_SIZE', '256')),
+    use_processes=os.environ.get('RENDER_EXECUTOR', 'process') == 'process'
+)
+payslip_renders = {}
+
+def _money(value: float) -> str:
+    return f"{value:.2f} €"
+
+def render_payslip_pdf(document: dict, path: str):
+    # Runs in render_pool; writes to a temp file so readers never see a partial PDF
+    tmp = f"{path}.{os.getpid()}.tmp"
+    width, height = A4
+    pdf = pdf_canvas.Canvas(tmp, pagesize=A4, invariant=1)
+    pdf.setTitle(f"Fiche de paie {document['period']}")
+    columns = [50, 130, 320, 380, 440, 500]
+    
+    def header(y):
+        pdf.setFont("Helvetica-Bold", 10)
+        for x, label in zip(columns, ["Date", "Établissement", "Heures", "Taux", "Déplac.", "Total"]):
+            pdf.drawString(x, y, label)
+        pdf.line(50, y - 4, width - 50, y - 4)
+        pdf.setFont("Helvetica", 10)
+        return y - 18
+    
+    y = height - 60
+    pdf.setFont("Helvetica-Bold", 18)
+    pdf.drawString(50, y, "Fiche de paie")
+    pdf.setFont("Helvetica", 11)
+    pdf.drawString(50, y - 22, document["name"])
+    pdf.drawString(50, y - 38, f"Période : {document['period']}")
+    pdf.drawString(50, y - 54, f"Générée le : {document['created_at']}")
+    y = header(y - 90)
+    
+    for date, institution, hours, rate, travel, total in document["lines"]:
+        if y < 140:
+            pdf.showPage()
+            y = header(height - 60)
+        for x, value in zip(columns, [date, institution[:32], f"{hours:g}", _money(rate), _money(travel), _money(total)]):
+            pdf.drawString(x, y, value)
+        y -= 16
+    
+    pdf.line(50, y + 8, width - 50, y + 8)
+    y -= 12
+    for label, value, font in [
+        ("Montant brut", _money(document["gross_total"]), "Helvetica"),
+        (f"Commission ({COMMISSION_RATE:.0%})", "-" + _money(document["commission"]), "Helvetica"),
+        ("Montant net", _money(document["net_total"]), "Helvetica-Bold")
+    ]:
+        pdf.setFont(font, 11)
+        pdf.drawString(columns[3], y, label)
+        pdf.drawRightString(width - 50, y, value)
+        y -= 18
+    pdf.save()
+    os.replace(tmp, path)
+
+async def payslip_document(payslip: dict) -> dict:
+    user = await db.users.find_one({"id": payslip["user_id"]}, {"_id": 0, "first_name": 1, "last_name": 1}) or {}
+    shifts = await db.shifts.find(
+        {"id": {"$in": payslip["shifts"]}},
+        {"_id": 0, "date": 1, "institution_id": 1, "hours": 1, "hourly_rate": 1, "travel_cost": 1}
+    ).sort("date", ASCENDING).to_list(len(payslip["shifts"]))
+    institution_ids = list({s["institution_id"] for s in shifts})
+    institutions = await db.institutions.find({"id": {"$in": institution_ids}}, {"_id": 0, "id": 1, "name": 1}).to_list(len(institution_ids))
+    names = {i["id"]: i["name"] for i in institutions}
+    
+    lines = []
+    for shift in shifts:
+        travel_cost = shift.get("travel_cost", 0.0)
+        lines.append([
+            _export_date(shift["date"])[:10], names.get(shift["institution_id"], ""),
+            shift["hours"], round(shift["hourly_rate"], 2), round(travel_cost, 2),
+            round(shift_total(shift["hours"], shift["hourly_rate"], travel_cost), 2)
+        ])
+    commission, net_total = payslip_amounts(payslip["gross_total"])
+    return {
+        "layout": PAYSLIP_PDF_LAYOUT,
+        "id": payslip["id"],
+        "name": f"{user.get('first_name', '')} {user.get('last_name', '')}".strip(),
+        "period": payslip["period"],
+        "created_at": _export_date(payslip["created_at"])[:10],
+        "lines": lines,
+        "gross_total": round(payslip["gross_total"], 2),
+        "commission": round(commission, 2),
+        "net_total": round(net_total, 2)
+    }
+
+def payslip_digest(document: dict) -> str:
+    return hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()
+
+async def render_payslip(document: dict, digest: str) -> Path:
+    path = PAYSLIP_PDF_DIR / f"{digest}.pdf"
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+    # Concurrent downloads of the same payslip share one render
+    pending = payslip_renders.get(digest)
+    if pending is None:
+        PAYSLIP_PDF_DIR.mkdir(parents=True, exist_ok=True)
+        pending = asyncio.ensure_future(render_pool.run(render_payslip_pdf, document, str(path)))
+        payslip_renders[digest] = pending
+        pending.add_done_callback(lambda _: payslip_renders.pop(digest, None))
+    await asyncio.shield(pending)
+    return path
+
+def prune_payslip_pdfs() -> int:
+    if not PAYSLIP_PDF_DIR.is_dir():
+        return 0
+    now = time.time()
+    files = []
+    removed = 0
+    for path in PAYSLIP_PDF_DIR.iterdir():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if path.suffix == ".tmp":
+            # Left behind by a render that died; live ones take seconds
+            if now - stat.st_mtime > 3600:
+                path.unlink(missing_ok=True)
+                removed += 1
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        if now - mtime <= PAYSLIP_PDF_MAX_AGE_DAYS * 86400 and total <= PAYSLIP_PDF_CACHE_MB * 1024 * 1024:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed
+
+async def run_payslip_pdf_pruner(interval: float):
+    while True:
+        try:
+            removed = await asyncio.to_thread(prune_payslip_pdfs)
+            if removed:
+                logger.info(f"Pruned {removed} cached payslip PDFs")
+        except Exception:
+            logger.exception("Payslip PDF cache pruning failed")
+        await asyncio.sleep(interval)
+
+# Pagination
+# List routes page on a stable (sort field, id) key. The opaque cursor for the
+# next page is returned in the X-Next-Cursor header and passed back as ?after=.
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', '1000'))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', '1000'))
+
+def encode_cursor(values: list) -> str:
+    values = [{"$date": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != 2:
+            raise ValueError("Cursor must hold two values")
+        return [to_datetime(v["$date"]) if isinstance(v, dict) else v for v in values]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_query(query: dict, sort_field: str, value, last_id: str, direction: int = ASCENDING) -> dict:
+    bound, seen = ("$gte", "$lte") if direction == ASCENDING else ("$lte", "$gte")
+    # A range on the sort field plus a residual filter, rather than an $or, so the
+    # planner still walks the (sort field, id) index
+    keyset = {sort_field: {bound: value}, "$nor": [{sort_field: value, "id": {seen: last_id}}]}
+    if list(query) == ["$or"]:
+        # Kept at the root so each branch can use its own index and the results merge sorted
+        return {"$or": [{"$and": [branch, keyset]} for branch in query["$or"]]}
+    return {"$and": [query, keyset]} if query else keyset
+
+async def fetch_page(collection, query: dict, response: Response, limit: int, after: Optional[str],
+                     sort_field: str = "created_at", direction: int = ASCENDING, projection: Optional[dict] = None) -> list:
+    if after:
+        value, last_id = decode_cursor(after)
+        query = keyset_query(query, sort_field, value, last_id, direction)
+    
+    docs = await collection.find(query, projection or {"_id": 0}).sort(
+        [(sort_field, direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor([docs[-1][sort_field], docs[-1]["id"]])
+    return docs
+
+# Responses
+# List routes encode the projected Mongo documents straight to JSON rather than
+# building a model per row and letting FastAPI validate the list a second time.
+# Set RESPONSE_VALIDATION to validate every row against the model instead.
+RESPONSE_VALIDATION = os.environ.get('RESPONSE_VALIDATION', '').lower() in ('1', 'true', 'yes')
+
+def _field_serializer(annotation, metadata=()):
+    # Returns a function converting the stored value the way the model would
+    for item in metadata:
+        if isinstance(item, PlainSerializer):
+            return lambda value, func=item.func: func(to_datetime(value))
+    if get_origin(annotation) is Annotated:
+        inner, *extra = get_args(annotation)
+        return _field_serializer(inner, extra)
+    if get_origin(annotation) is list:
+        func = _field_serializer(get_args(annotation)[0])
+        if func is not None:
+            return lambda values: [_serialize_value(func, value) for value in values]
+        return None
+    for arg in get_args(annotation):
+        func = _field_serializer(arg)
+        if func is not None:
+            return func
+    return None
+
+def _serialize_value(serializer, value):
+    # Unparseable legacy strings pass through
+    try:
+        return serializer(value)
+    except ValueError:
+        return value
+
+class ModelEncoder:
+    def __init__(self, model):
+        self.adapter = TypeAdapter(List[model])
+        self.projection = {"_id": 0, **{name: 1 for name in model.model_fields}}
+        self.fields = [
+            (
+                name,
+                None if field.is_required() else field.get_default(call_default_factory=True),
+                _field_serializer(field.annotation, field.metadata),
+                field.annotation is float
+            )
+            for name, field in model.model_fields.items()
+        ]
+
+    def row(self, doc: dict) -> dict:
+        out = {}
+        for name, default, serializer, is_float in self.fields:
+            value = doc.get(name, default)
+            if serializer is not None and value is not None:
+                value = _serialize_value(serializer, value)
+            elif is_float and isinstance(value, int):
+                value = float(value)
+            out[name] = value
+        return out
+
+    def dumps(self, docs: List[dict]) -> bytes:
+        if RESPONSE_VALIDATION:
+            return self.adapter.dump_json(self.adapter.validate_python(docs))
+        rows = [self.row(doc) for doc in docs]
+        if orjson is not None:
+            return orjson.dumps(rows)
+        return json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode()
+
+_encoders = {}
+
+def encoder_for(model) -> ModelEncoder:
+    if model not in _encoders:
+        _encoders[model] = ModelEncoder(model)
+    return _encoders[model]
+
+def list_response(model, docs: List[dict], response: Response) -> Response:
+    # Headers set on the injected response (X-Next-Cursor, ETag) are not merged
+    # into a returned Response, so carry them over
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    return Response(content=encoder_for(model).dumps(docs), media_type="application/json", headers=headers)
+
+# Dashboard counters
+# When enabled, write routes keep a "global" and a "user:<id>" document in
+# dashboard_counters up to date so the dashboard becomes a single read.
+DASHBOARD_COUNTERS = os.environ.get('DASHBOARD_COUNTERS', '').lower() in ('1', 'true', 'yes')
+
+def _user_counters(user: dict) -> dict:
+    return {
+        "total_users": 1,
+        "pending_users": 1 if user.get("status") == "pending" else 0
+    }
+
+def _global_shift_counters(shift: dict) -> dict:
+    return {
+        "total_shifts": 1,
+        "pending_shifts": 1 if shift["status"] == "pending" else 0,
+        f"daily_revenue.{day_key(shift['created_at'])}": shift["total"]
+    }
+
+def _user_shift_counters(shift: dict) -> dict:
+    return {
+        "total_shifts": 1,
+        "total_hours": shift["hours"],
+        "total_earned": shift["total"] if shift["status"] == "paid" else 0,
+        "pending_amount": shift["total"] if shift["status"] in ["pending", "validated"] else 0
+    }
+
+async def bump_counters(counter_id: str, inc: dict):
+    inc = {field: value for field, value in inc.items() if value}
+    if DASHBOARD_COUNTERS and inc:
+        await db.dashboard_counters.update_one({"id": counter_id}, {"$inc": inc}, upsert=True)
+
+async def bump_counters_many(incs: dict):
+    operations = []
+    for counter_id, inc in incs.items():
+        inc = {field: value for field, value in inc.items() if value}
+        if inc:
+            operations.append(UpdateOne({"id": counter_id}, {"$inc": inc}, upsert=True))
+    if DASHBOARD_COUNTERS and operations:
+        await db.dashboard_counters.bulk_write(operations, ordered=False)
+
+async def _track_changes(changes: list, counters):
+    if not DASHBOARD_COUNTERS:
+        return
+    deltas = {}
+    for before, after in changes:
+        for doc, sign in ((before, -1), (after, 1)):
+            if doc is None:
+                continue
+            for counter_id, values in counters(doc):
+                target = deltas.setdefault(counter_id, {})
+                for field, value in values.items():
+                    target[field] = target.get(field, 0) + sign * value
+    await bump_counters_many(deltas)
+
+def _shift_counter_docs(shift: dict) -> list:
+    return [
+        ("global", _global_shift_counters(shift)),
+        (f"user:{shift['user_id']}", _user_shift_counters(shift))
+    ]
+
+def _user_counter_docs(user: dict) -> list:
+    return [("global", _user_counters(user))]
+
+async def track_user_change(before: Optional[dict], after: Optional[dict]):
+    await _track_changes([(before, after)], _user_counter_docs)
+
+async def track_user_changes(changes: list):
+    await _track_changes(changes, _user_counter_docs)
+
+async def track_shift_change(before: Optional[dict], after: Optional[dict]):
+    await _track_changes([(before, after)], _shift_counter_docs)
+
+async def track_shift_changes(changes: list):
+    await _track_changes(changes, _shift_counter_docs)
+
+# Versions
+# A change counter per scope ("institutions", "schedules", "messages:<user_id>",
+# "notifications:<user_id>"), bumped after every write to that scope. List routes
+# derive their ETag from it and answer 304 without querying the collection.
+def version_scopes(prefix: str, user_ids) -> List[str]:
+    return [f"{prefix}:{user_id}" for user_id in set(user_ids)]
+
+async def bump_versions(*scopes: str):
+    operations = [
+        UpdateOne({"id": scope}, {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}}, upsert=True)
+        for scope in scopes
+    ]
+    if operations:
+        await db.versions.bulk_write(operations, ordered=False)
+
+async def list_etag(request: Request, current_user: User, *scopes: str, salt: str = "") -> str:
+    docs = await db.versions.find({"id": {"$in": list(scopes)}}, {"_id": 0}).to_list(len(scopes))
+    stamps = {d["id"]: f"{d['epoch']}.{d['version']}" for d in docs}
+    # The same query string can return different rows per caller (role/user filters)
+    key = json.dumps([[scope, stamps.get(scope, "0")] for scope in scopes] + [current_user.id, str(request.url.query), salt])
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+async def not_modified(request: Request, response: Response, current_user: User, *scopes: str, salt: str = "") -> Optional[Response]:
+    # salt covers changes no write bumps a scope for
+    etag = await list_etag(request, current_user, *scopes, salt=salt)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# Sync
+# Writes to the collections below append one sync_changes entry per document,
+# numbered from a single sequence and tagged with the users who can see it ("*"
+# for every admin). GET /sync?since= replays the entries after a cursor with the
+# current documents; documents that are gone or no longer visible come back as
+# deletes. Notifications dropped by the TTL index are not replayed.
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+# Writes can land slightly out of sequence order, so the returned cursor stays
+# behind entries younger than this and they are sent again on the next call
+SYNC_SETTLE_SECONDS = float(os.environ.get('SYNC_SETTLE_SECONDS', '5'))
+SYNC_ADMINS = "*"
+
+SYNC_TYPES = {
+    "shifts": {"collection": "shifts", "model": Shift, "owners": ("user_id",), "admins": True},
+    "schedules": {"collection": "schedules", "model": Schedule, "owners": ("user_id",), "admins": True},
+    "payslips": {"collection": "payslips", "model": Payslip, "owners": ("user_id",), "admins": True},
+    "exchanges": {"collection": "shift_exchanges", "model": ShiftExchange, "owners": ("from_user_id", "to_user_id"), "admins": False},
+    "notifications": {"collection": "notifications", "model": Notification, "owners": ("user_id",), "admins": False},
+}
+
+async def next_sequence(name: str, count: int = 1) -> int:
+    doc = await db.versions.find_one_and_update(
+        {"id": name}, {"$inc": {"version": count}}, {"_id": 0, "version": 1},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return doc["version"]
+
+async def record_changes(sync_type: str, docs: List[dict]):
+    # Pass the document before and after an owner change so both sides hear about it
+    spec = SYNC_TYPES[sync_type]
+    audiences = {}
+    for doc in docs:
+        users = audiences.setdefault(doc["id"], set())
+        users.update(doc[field] for field in spec["owners"] if doc.get(field))
+        if spec["admins"]:
+            users.add(SYNC_ADMINS)
+    if not audiences:
+        return
+    last = await next_sequence("sync", len(audiences))
+    # Stamped after the sequence is taken; the settle window relies on it
+    now = datetime.now(timezone.utc)
+    await db.sync_changes.insert_many([
+        {"seq": last - len(audiences) + i, "type": sync_type, "id": doc_id, "users": sorted(users), "at": now}
+        for i, (doc_id, users) in enumerate(audiences.items(), start=1)
+    ], ordered=False)
+
+def sync_visible(spec: dict, doc: dict, current_user: User) -> bool:
+    if spec["admins"] and current_user.role == "admin":
+        return True
+    return any(doc.get(field) == current_user.id for field in spec["owners"])
+
+async def sync_changes_since(since: int, limit: int, current_user: User) -> dict:
+    users = [current_user.id, SYNC_ADMINS] if current_user.role == "admin" else [current_user.id]
+    entries = await db.sync_changes.find(
+        {"users": {"$in": users}, "seq": {"$gt": since}},
+        {"_id": 0, "seq": 1, "type": 1, "id": 1, "at": 1}
+    ).sort("seq", ASCENDING).limit(limit).to_list(limit)
+    
+    # The cursor stops before the first unsettled entry, full page or not; a write
+    # that took a lower seq may still be landing behind it
+    settled = datetime.now(timezone.utc) - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    cursor = since
+    for entry in entries:
+        if to_datetime(entry["at"]) > settled:
+            break
+        cursor = entry["seq"]
+    # Without progress another call would return the same page
+    has_more = len(entries) == limit and cursor > since
+    
+    # Only the latest entry per document matters; it is answered with the current state
+    latest = {}
+    for entry in entries:
+        latest[(entry["type"], entry["id"])] = entry["seq"]
+    changes = []
+    for sync_type, spec in SYNC_TYPES.items():
+        ids = [doc_id for kind, doc_id in latest if kind == sync_type]
+        if not ids:
+            continue
+        encoder = encoder_for(spec["model"])
+        docs = await db[spec["collection"]].find({"id": {"$in": ids}}, encoder.projection).to_list(None)
+        found = {doc["id"]: doc for doc in docs if sync_visible(spec, doc, current_user)}
+        for doc_id in ids:
+            doc = found.get(doc_id)
+            changes.append({
+                "seq": latest[(sync_type, doc_id)],
+                "type": sync_type,
+                "id": doc_id,
+                "op": "upsert" if doc else "delete",
+                "data": encoder.row(doc) if doc else None
+            })
+    changes.sort(key=lambda change: change["seq"])
+    return {"cursor": cursor, "changes": changes, "has_more": has_more}
+
+# Push events
+# Per-user in-process pub/sub. Every event gets a per-user cursor "<epoch>:<seq>";
+# a recent history is kept so reconnecting clients can resume without gaps.
+class _Subscriber:
+    def __init__(self, max_queue: int):
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.lagged = False
+
+class EventHub:
+    def __init__(self, history_size: int, max_queue: int):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.history_size = history_size
+        self.max_queue = max_queue
+        self.seq = {}
+        self.history = {}
+        self.subscribers = {}
+
+    def publish(self, user_id: str, event_type: str, data: dict):
+        seq = self.seq.get(user_id, 0) + 1
+        self.seq[user_id] = seq
+        event = {"cursor": f"{self.epoch}:{seq}", "seq": seq, "type": event_type, "data": data}
+        self.history.setdefault(user_id, deque(maxlen=self.history_size)).append(event)
+        for subscriber in self.subscribers.get(user_id, ()):
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.lagged = True
+
+    def subscribe(self, user_id: str) -> _Subscriber:
+        subscriber = _Subscriber(self.max_queue)
+        self.subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id: str, subscriber: _Subscriber):
+        subscribers = self.subscribers.get(user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[user_id]
+
+    def replay(self, user_id: str, cursor: Optional[str]) -> Optional[list]:
+        # Events after the cursor, or None when the client must refetch
+        if not cursor:
+            return []
+        epoch, _, seq = cursor.partition(":")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        last = int(seq)
+        history = self.history.get(user_id, ())
+        if last > self.seq.get(user_id, 0):
+            return None
+        if history and history[0]["seq"] > last + 1:
+            return None
+        return [event for event in history if event["seq"] > last]
+
+event_hub = EventHub(
+    history_size=int(os.environ.get('EVENT_HISTORY_SIZE', '200')),
+    max_queue=int(os.environ.get('EVENT_QUEUE_SIZE', '500'))
+)
+EVENT_KEEPALIVE_SECONDS = float(os.environ.get('EVENT_KEEPALIVE_SECONDS', '15'))
+
+def format_sse(event: dict) -> str:
+    return f"id: {event['cursor']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+def build_notification(user_id: str, notification_type: str, content: str) -> dict:
+    return {
         "id": str(uuid.uuid4()),
         "user_id": user_id,
         "type": notification_type,
         "content": content,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "timestamp": datetime.now(timezone.utc),
         "read": False
     }
-    await db.notifications.insert_one(notification)
+
+class NotificationOutbox:
+    # Queues notifications and writes them with insert_many in size- or time-bounded batches
+    def __init__(self, batch_size: int, flush_interval: float, max_size: int, retry_delay: float, max_retry_delay: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.queue = None
+        self.task = None
+        self.flushed = 0
+        self.batches = 0
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.task = asyncio.create_task(self._run())
+
+    async def put(self, notification: dict):
+        # Without a running writer (e.g. before startup) fall back to a direct insert
+        if self.task is None or self.task.done():
+            await db.notifications.insert_one(notification)
+            await record_notifications([notification])
+            publish_notifications([notification])
+            return
+        await self.queue.put(notification)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[dict]):
+        # Failed steps (failover, network errors) are retried with backoff until they
+        # succeed instead of dropping the batch; producers wait on the bounded queue
+        delay = self.retry_delay
+        try:
+            for step in (self._insert, record_notifications):
+                while True:
+                    try:
+                        await step(batch)
+                        break
+                    except Exception:
+                        logger.exception(f"Failed to write {len(batch)} notifications, retrying in {delay:.1f}s")
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, self.max_retry_delay)
+            publish_notifications(batch)
+            self.flushed += len(batch)
+            self.batches += 1
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _insert(self, batch: List[dict]):
+        try:
+            await db.notifications.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Rows written by an earlier attempt come back as duplicates
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+    async def drain(self, timeout: Optional[float] = None):
+        if self.task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Shutting down with {self.queue.qsize()} notifications not written")
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+notification_outbox = NotificationOutbox(
+    batch_size=int(os.environ.get('NOTIFICATION_BATCH_SIZE', '100')),
+    flush_interval=float(os.environ.get('NOTIFICATION_FLUSH_INTERVAL', '0.05')),
+    max_size=int(os.environ.get('NOTIFICATION_QUEUE_SIZE', '10000')),
+    retry_delay=float(os.environ.get('NOTIFICATION_RETRY_DELAY', '0.1')),
+    max_retry_delay=float(os.environ.get('NOTIFICATION_RETRY_MAX_DELAY', '5'))
+)
+
+async def record_notifications(notifications: List[dict]):
+    # Runs after the insert so the unread counters and list ETags never run ahead of the data
+    unread = {}
+    for n in notifications:
+        if not n.get("read"):
+            unread[n["user_id"]] = unread.get(n["user_id"], 0) + 1
+    if unread:
+        await db.notification_counters.bulk_write([
+            UpdateOne({"id": user_id}, {"$inc": {"unread": count}}, upsert=True)
+            for user_id, count in unread.items()
+        ], ordered=False)
+    await bump_versions(*version_scopes("notifications", (n["user_id"] for n in notifications)))
+    await record_changes("notifications", notifications)
+
+def publish_notifications(notifications: List[dict]):
+    # Only once the rows and unread counters are written, so clients refetching on
+    # the event see the new count
+    for n in notifications:
+        event_hub.publish(n["user_id"], "notification", Notification(**n).model_dump(mode="json"))
+
+async def rebuild_notification_counters():
+    unread = await db.notifications.aggregate([
+        {"$match": {"read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}}
+    ]).to_list(None)
+    await db.notification_counters.update_many({}, {"$set": {"unread": 0}})
+    if unread:
+        await db.notification_counters.bulk_write([
+            UpdateOne({"id": row["_id"]}, {"$set": {"unread": row["unread"]}}, upsert=True)
+            for row in unread
+        ], ordered=False)
+
+async def archive_read_notifications(batch_size: int = 1000) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=NOTIFICATION_RETENTION_DAYS)
+    archived = 0
+    while True:
+        batch = await db.notifications.find({"read_at": {"$lt": cutoff}}, {"_id": 0}).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return archived
+        ids = [n["id"] for n in batch]
+        # Anything already archived by an interrupted pass is skipped, then deleted here
+        already = set(await db.notifications_archive.distinct("id", {"id": {"$in": ids}}))
+        fresh = [n for n in batch if n["id"] not in already]
+        if fresh:
+            await db.notifications_archive.insert_many(fresh, ordered=False)
+        await db.notifications.delete_many({"id": {"$in": ids}})
+        await bump_versions(*version_scopes("notifications", (n["user_id"] for n in batch)))
+        await record_changes("notifications", batch)
+        archived += len(batch)
+
+async def run_notification_archiver(interval: float):
+    while True:
+        try:
+            archived = await archive_read_notifications()
+            if archived:
+                logger.info(f"Archived {archived} read notifications")
+        except Exception:
+            logger.exception("Notification archival failed")
+        await asyncio.sleep(interval)
+
+async def create_notification(user_id: str, notification_type: str, content: str):
+    await notification_outbox.put(build_notification(user_id, notification_type, content))
+
+COMMISSION_RATE = 0.07
+
+def shift_total(hours: float, hourly_rate: float, travel_cost: float) -> float:
+    return (hours * hourly_rate) + travel_cost
+
+def payslip_amounts(gross_total: float) -> tuple:
+    commission = gross_total * COMMISSION_RATE
+    return commission, gross_total - commission
+
+def build_payslip(user_id: str, period: str, shift_ids: List[str], gross_total: float) -> dict:
+    commission, net_total = payslip_amounts(gross_total)
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "period": period,
+        "shifts": shift_ids,
+        "gross_total": gross_total,
+        "commission": commission,
+        "net_total": net_total,
+        "created_at": datetime.now(timezone.utc)
+    }
 
 # Routes
 @api_router.post("/auth/register", response_model=User)
@@ -208,41 +1768,133 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     user_dict = user_data.model_dump()
-    user_dict["password_hash"] = hash_password(user_dict.pop("password"))
+    if (user_dict.get("photo") or "").startswith("data:"):
+        user_dict["photo"], user_dict["photo_thumb"] = await store_photo(user_dict["photo"])
+    user_dict["password_hash"] = await password_pool.hash(user_dict.pop("password"))
     user_dict["id"] = str(uuid.uuid4())
     user_dict["status"] = "pending" if user_data.role != "admin" else "approved"
-    user_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    user_dict["created_at"] = datetime.now(timezone.utc)
     
     await db.users.insert_one(user_dict)
+    principal_cache.invalidate(user_dict["id"])
+    await track_user_change(None, user_dict)
     
     # Notify admins
-    admins = await db.users.find({"role": "admin"}, {"_id": 0}).to_list(100)
+    admins = await db.users.find({"role": "admin"}, {"_id": 0, "id": 1}).to_list(100)
     for admin in admins:
         await create_notification(admin["id"], "new_user", f"Nouvelle inscription: {user_data.first_name} {user_data.last_name}")
     
     return User(**{k: v for k, v in user_dict.items() if k != "password_hash"})
 
+@api_router.post("/users/import")
+async def import_users(request: Request, stream: bool = False, status: str = "approved", current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if status not in ("pending", "approved"):
+        raise HTTPException(status_code=400, detail="status must be pending or approved")
+    items = await read_import(request)
+    
+    async def handler(offset: int, chunk: list) -> list:
+        results = {}
+        valid = {}
+        for index, raw in enumerate(chunk, start=offset):
+            try:
+                valid[index] = parse_import_row(UserCreate, raw)
+            except ValueError as e:
+                results[index] = {"index": index, "status": "error", "error": str(e)}
+        
+        existing = set(await db.users.distinct("email", {"email": {"$in": [u.email for u in valid.values()]}}))
+        seen = set()
+        for index, data in list(valid.items()):
+            if data.email in existing or data.email in seen:
+                results[index] = {"index": index, "status": "error", "error": "Email already registered"}
+                del valid[index]
+            seen.add(data.email)
+        
+        docs = {}
+        for index, data in list(valid.items()):
+            user_dict = data.model_dump(exclude={"password"})
+            if (user_dict.get("photo") or "").startswith("data:"):
+                try:
+                    user_dict["photo"], user_dict["photo_thumb"] = await store_photo(user_dict["photo"])
+                except HTTPException as e:
+                    results[index] = {"index": index, "status": "error", "error": e.detail}
+                    del valid[index]
+                    continue
+            docs[index] = user_dict
+        
+        hashes = await password_pool.map(hash_password, [data.password for data in valid.values()])
+        now = datetime.now(timezone.utc)
+        for (index, data), password_hash in zip(valid.items(), hashes):
+            user_dict = docs[index]
+            user_dict["password_hash"] = password_hash
+            user_dict["id"] = str(uuid.uuid4())
+            user_dict["status"] = "approved" if data.role == "admin" else status
+            user_dict["created_at"] = now
+        
+        failed = set()
+        if docs:
+            try:
+                await db.users.insert_many(list(docs.values()), ordered=False)
+            except BulkWriteError as e:
+                # Emails registered concurrently since the lookup above hit the unique index
+                indexes = list(docs)
+                failed = {indexes[error["index"]] for error in e.details["writeErrors"]}
+        for index in failed:
+            results[index] = {"index": index, "status": "error", "error": "Email already registered"}
+        created = [doc for index, doc in docs.items() if index not in failed]
+        for doc in created:
+            principal_cache.invalidate(doc["id"])
+        await track_user_changes([(None, doc) for doc in created])
+        for index, doc in docs.items():
+            if index not in failed:
+                results[index] = {"index": index, "status": "created", "id": doc["id"]}
+        return [results[index] for index in sorted(results)]
+    
+    return await bulk_response(items, handler, stream, finish=lambda summary: notify_import(summary, "comptes"))
+
 @api_router.post("/auth/login", response_model=Token)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    if not user or not await password_pool.verify(credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if user["status"] != "approved":
         raise HTTPException(status_code=403, detail="Account pending approval")
     
-    token = create_access_token({"sub": user["id"]})
     user_obj = User(**{k: v for k, v in user.items() if k != "password_hash"})
-    return Token(access_token=token, token_type="bearer", user=user_obj)
+    return Token(token_type="bearer", user=user_obj, **issue_tokens(user))
+
+@api_router.post("/auth/refresh", response_model=Token)
+async def refresh_tokens(data: RefreshRequest):
+    try:
+        payload = jwt.decode(data.refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("typ") != "refresh":
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    user = await db.users.find_one({"id": payload["sub"]}, {"_id": 0, "password_hash": 0})
+    if not user or payload.get("ver") != user.get("token_version", 0):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    if user["status"] != "approved":
+        raise HTTPException(status_code=403, detail="Account pending approval")
+    return Token(token_type="bearer", user=User(**user), **issue_tokens(user))
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
+    # Claims-based principals only carry what authorization needs
+    user = await db.users.find_one({"id": current_user.id}, {"_id": 0, "password_hash": 0})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    return User(**user)
 
 @api_router.get("/users", response_model=List[User])
-async def get_users(current_user: User = Depends(get_current_user)):
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
-    return [User(**u) for u in users]
+async def get_users(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    users = await fetch_page(db.users, {}, response, limit, after, projection=encoder_for(User).projection)
+    return list_response(User, users, response)
 
 @api_router.get("/users/{user_id}", response_model=User)
 async def get_user(user_id: str, current_user: User = Depends(get_current_user)):
@@ -256,9 +1908,12 @@ async def update_user_status(user_id: str, status: str, current_user: User = Dep
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    result = await db.users.update_one({"id": user_id}, {"$set": {"status": status}})
-    if result.matched_count == 0:
+    before = await db.users.find_one_and_update({"id": user_id}, {"$set": {"status": status}}, {"_id": 0, "status": 1})
+    principal_cache.invalidate(user_id)
+    if before is None:
         raise HTTPException(status_code=404, detail="User not found")
+    await revoke_tokens(user_id)
+    await track_user_change(before, {"status": status})
     
     await create_notification(user_id, "status_update", f"Votre compte a été {status}")
     return {"message": "Status updated"}
@@ -269,12 +1924,84 @@ async def update_user(user_id: str, updates: dict, current_user: User = Depends(
         raise HTTPException(status_code=403, detail="Unauthorized")
     
     if "password" in updates:
-        updates["password_hash"] = hash_password(updates.pop("password"))
+        updates["password_hash"] = await password_pool.hash(updates.pop("password"))
+    photo_uploaded = isinstance(updates.get("photo"), str) and updates["photo"].startswith("data:")
+    if photo_uploaded:
+        updates["photo"], updates["photo_thumb"] = await store_photo(updates["photo"])
     
-    result = await db.users.update_one({"id": user_id}, {"$set": updates})
-    if result.matched_count == 0:
+    before = await db.users.find_one_and_update({"id": user_id}, {"$set": updates}, {"_id": 0, **{field: 1 for field in TOKEN_CLAIM_FIELDS}})
+    principal_cache.invalidate(user_id)
+    if before is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return {"message": "User updated"}
+    if "status" in updates:
+        await track_user_change(before, {"status": updates["status"]})
+    
+    result = {"message": "User updated"}
+    if "password_hash" in updates or any(field in updates and updates[field] != before.get(field) for field in TOKEN_CLAIM_FIELDS):
+        await revoke_tokens(user_id)
+        if user_id == current_user.id:
+            # Hand the caller fresh tokens instead of logging them out
+            user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+            result.update(issue_tokens(user))
+    if photo_uploaded:
+        result.update({"photo": updates["photo"], "photo_thumb": updates["photo_thumb"]})
+    return result
+
+@api_router.get("/admin/indexes")
+async def get_index_report(explain: bool = False, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    report = await ensure_indexes(create=False)
+    if explain:
+        report["plan_issues"] = await explain_audit()
+    return report
+
+@api_router.get("/admin/migrations/dates")
+async def get_date_migration(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    state = await db.migrations.find_one({"id": DATE_MIGRATION_ID}, {"_id": 0}) or {}
+    return date_migration_report(state.get("collections", {}))
+
+@api_router.post("/admin/migrations/dates")
+async def run_date_migration(restart: bool = False, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return await migrate_dates(restart=restart)
+
+@api_router.get("/admin/principal-cache")
+async def get_principal_cache_stats(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return principal_cache.stats()
+
+@api_router.get("/admin/token-revocations")
+async def get_token_revocation_stats(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return token_revocations.stats()
+
+@api_router.get("/admin/password-pool")
+async def get_password_pool_stats(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return password_pool.stats()
+
+@api_router.get("/photos/{name}")
+async def get_photo(name: str, request: Request):
+    # Served without auth so <img> tags can load them; names are content hashes
+    if not PHOTO_NAME.match(name):
+        raise HTTPException(status_code=404, detail="Photo not found")
+    etag = f'"{name}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    path = PHOTO_DIR / name
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Photo not found")
+    return FileResponse(path, media_type=PHOTO_MEDIA_TYPES[name.rsplit(".", 1)[1]], headers=headers)
 
 # Institutions
 @api_router.post("/institutions", response_model=Institution)
@@ -284,72 +2011,621 @@ async def create_institution(data: InstitutionCreate, current_user: User = Depen
     
     inst_dict = data.model_dump()
     inst_dict["id"] = str(uuid.uuid4())
-    inst_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    inst_dict["created_at"] = datetime.now(timezone.utc)
     
     await db.institutions.insert_one(inst_dict)
+    await bump_counters("global", {"total_institutions": 1})
+    await bump_versions("institutions")
     return Institution(**inst_dict)
 
+@api_router.post("/institutions/import")
+async def import_institutions(request: Request, stream: bool = False, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    items = await read_import(request)
+    
+    async def handler(offset: int, chunk: list) -> list:
+        results = []
+        docs = []
+        now = datetime.now(timezone.utc)
+        for index, raw in enumerate(chunk, start=offset):
+            try:
+                inst_dict = parse_import_row(InstitutionCreate, raw).model_dump()
+            except ValueError as e:
+                results.append({"index": index, "status": "error", "error": str(e)})
+                continue
+            inst_dict["id"] = str(uuid.uuid4())
+            inst_dict["created_at"] = now
+            docs.append(inst_dict)
+            results.append({"index": index, "status": "created", "id": inst_dict["id"]})
+        if docs:
+            await db.institutions.insert_many(docs, ordered=False)
+            await bump_counters("global", {"total_institutions": len(docs)})
+            await bump_versions("institutions")
+        return results
+    
+    return await bulk_response(items, handler, stream, finish=lambda summary: notify_import(summary, "établissements"))
+
 @api_router.get("/institutions", response_model=List[Institution])
-async def get_institutions(current_user: User = Depends(get_current_user)):
-    institutions = await db.institutions.find({}, {"_id": 0}).to_list(1000)
-    return [Institution(**i) for i in institutions]
+async def get_institutions(request: Request, response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    cached = await not_modified(request, response, current_user, "institutions")
+    if cached:
+        return cached
+    
+    institutions = await fetch_page(db.institutions, {}, response, limit, after, projection=encoder_for(Institution).projection)
+    return list_response(Institution, institutions, response)
 
 # Schedules
 @api_router.post("/schedules", response_model=Schedule)
 async def create_schedule(data: ScheduleCreate, current_user: User = Depends(get_current_user)):
     schedule_dict = data.model_dump()
+    try:
+        schedule_dict["starts_at"], schedule_dict["ends_at"] = schedule_window(data.date, data.start_time, data.end_time)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Times must be HH:MM")
     schedule_dict["id"] = str(uuid.uuid4())
-    schedule_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    schedule_dict["created_at"] = datetime.now(timezone.utc)
     
     await db.schedules.insert_one(schedule_dict)
+    await bump_versions("schedules")
+    await record_changes("schedules", [schedule_dict])
     return Schedule(**schedule_dict)
 
 @api_router.get("/schedules", response_model=List[Schedule])
-async def get_schedules(user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_schedules(request: Request, response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
     query = {}
     if user_id:
         query["user_id"] = user_id
     elif current_user.role != "admin":
         query["user_id"] = current_user.id
     
-    schedules = await db.schedules.find(query, {"_id": 0}).to_list(1000)
-    return [Schedule(**s) for s in schedules]
+    await extend_schedule_templates()
+    cached = await not_modified(request, response, current_user, "schedules")
+    if cached:
+        return cached
+    schedules = await fetch_page(db.schedules, query, response, limit, after, projection=encoder_for(Schedule).projection)
+    return list_response(Schedule, schedules, response)
 
 @api_router.patch("/schedules/{schedule_id}")
 async def update_schedule(schedule_id: str, updates: dict, current_user: User = Depends(get_current_user)):
-    result = await db.schedules.update_one({"id": schedule_id}, {"$set": updates})
-    if result.matched_count == 0:
+    if {"date", "start_time", "end_time"} & updates.keys():
+        current = await db.schedules.find_one({"id": schedule_id}, {"_id": 0, "date": 1, "start_time": 1, "end_time": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Schedule not found")
+        merged = {**current, **updates}
+        try:
+            if "date" in updates:
+                updates["date"] = to_datetime(updates["date"])
+            updates["starts_at"], updates["ends_at"] = schedule_window(merged["date"], merged["start_time"], merged["end_time"])
+        except (ValueError, AttributeError):
+            raise HTTPException(status_code=400, detail="Invalid date or time")
+    
+    update = {"$set": updates}
+    # A slot moved by hand no longer follows its template
+    if "starts_at" in updates:
+        update["$unset"] = {"template_id": ""}
+    before = await db.schedules.find_one_and_update({"id": schedule_id}, update, {"_id": 0, "id": 1, "user_id": 1})
+    if before is None:
         raise HTTPException(status_code=404, detail="Schedule not found")
+    await bump_versions("schedules")
+    await record_changes("schedules", [before, {**before, **updates}])
     return {"message": "Schedule updated"}
 
+# Schedule templates
+# Weekly patterns expanded into ordinary schedules. Occurrences are only created
+# up to SCHEDULE_HORIZON_DAYS ahead; routes reading schedules roll the horizon
+# forward at most once a day per process. Editing a template only rewrites the
+# available occurrences from today on, and leaves booked ones untouched.
+SCHEDULE_HORIZON_DAYS = int(os.environ.get('SCHEDULE_HORIZON_DAYS', '56'))
+template_horizon_day = None
+
+def utc_today() -> datetime:
+    return datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def check_template(data: ScheduleTemplateCreate):
+    if not data.weekdays or any(day not in range(7) for day in data.weekdays):
+        raise HTTPException(status_code=400, detail="weekdays must be numbers from 0 (Monday) to 6 (Sunday)")
+    if not data.slots:
+        raise HTTPException(status_code=400, detail="At least one time slot is required")
+    try:
+        for slot in data.slots:
+            schedule_window(data.starts_on, slot.start_time, slot.end_time)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Times must be HH:MM")
+    if data.ends_on and data.ends_on < data.starts_on:
+        raise HTTPException(status_code=400, detail="ends_on must not be before starts_on")
+
+def template_occurrences(template: dict, start: datetime, end: datetime) -> list:
+    # (day, start_time, end_time) for every slot between start and end, both included
+    weekdays = set(template["weekdays"])
+    exceptions = {day_key(day) for day in template.get("exceptions") or []}
+    day = max(start, to_datetime(template["starts_on"])).replace(hour=0, minute=0, second=0, microsecond=0)
+    if template.get("ends_on"):
+        end = min(end, to_datetime(template["ends_on"]))
+    occurrences = []
+    while day <= end:
+        if day.weekday() in weekdays and day_key(day) not in exceptions:
+            occurrences.extend((day, slot["start_time"], slot["end_time"]) for slot in template["slots"])
+        day += timedelta(days=1)
+    return occurrences
+
+def build_occurrence(template: dict, day: datetime, start_time: str, end_time: str, now: datetime) -> dict:
+    starts_at, ends_at = schedule_window(day, start_time, end_time)
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": template["user_id"],
+        "institution_id": template["institution_id"],
+        "date": day,
+        "start_time": start_time,
+        "end_time": end_time,
+        "status": template["status"],
+        "starts_at": starts_at,
+        "ends_at": ends_at,
+        "template_id": template["id"],
+        "created_at": now
+    }
+
+def template_finished(template: dict, expanded_until: datetime) -> bool:
+    # Finished templates drop out of the daily horizon scan
+    return bool(template.get("ends_on")) and to_datetime(expanded_until) >= to_datetime(template["ends_on"])
+
+async def expand_template(template: dict, until: datetime) -> int:
+    expanded = to_datetime(template["expanded_until"])
+    if expanded >= until:
+        return 0
+    # Claim the range first so concurrent expansions never insert the same days twice
+    result = await db.schedule_templates.update_one(
+        {"id": template["id"], "expanded_until": template["expanded_until"]},
+        {"$set": {"expanded_until": until, "finished": template_finished(template, until)}}
+    )
+    if result.modified_count == 0:
+        return 0
+    now = datetime.now(timezone.utc)
+    docs = [
+        build_occurrence(template, day, start_time, end_time, now)
+        for day, start_time, end_time in template_occurrences(template, expanded + timedelta(days=1), until)
+    ]
+    if docs:
+        await db.schedules.insert_many(docs, ordered=False)
+        await record_changes("schedules", docs)
+    return len(docs)
+
+async def extend_schedule_templates():
+    global template_horizon_day
+    today = utc_today()
+    if template_horizon_day == today:
+        return
+    until = today + timedelta(days=SCHEDULE_HORIZON_DAYS)
+    templates = await db.schedule_templates.find(
+        {"finished": {"$in": [False, None]}, "expanded_until": {"$lt": until}}, {"_id": 0}
+    ).to_list(None)
+    inserted = 0
+    for template in templates:
+        inserted += await expand_template(template, until)
+    if inserted:
+        await bump_versions("schedules")
+    template_horizon_day = today
+
+@api_router.post("/schedule-templates", response_model=ScheduleTemplate)
+async def create_schedule_template(data: ScheduleTemplateCreate, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin" and current_user.id != data.user_id:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    check_template(data)
+    
+    template = data.model_dump()
+    template["id"] = str(uuid.uuid4())
+    # Nothing is generated before today
+    template["expanded_until"] = max(data.starts_on, utc_today()) - timedelta(days=1)
+    template["finished"] = False
+    template["created_at"] = datetime.now(timezone.utc)
+    
+    await db.schedule_templates.insert_one(template)
+    if await expand_template(template, utc_today() + timedelta(days=SCHEDULE_HORIZON_DAYS)):
+        await bump_versions("schedules")
+    template = await db.schedule_templates.find_one({"id": template["id"]}, {"_id": 0})
+    return ScheduleTemplate(**template)
+
+@api_router.get("/schedule-templates", response_model=List[ScheduleTemplate])
+async def get_schedule_templates(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    query = {}
+    if current_user.role != "admin":
+        query["user_id"] = current_user.id
+    elif user_id:
+        query["user_id"] = user_id
+    
+    templates = await fetch_page(db.schedule_templates, query, response, limit, after, projection=encoder_for(ScheduleTemplate).projection)
+    return list_response(ScheduleTemplate, templates, response)
+
+@api_router.patch("/schedule-templates/{template_id}")
+async def update_schedule_template(template_id: str, updates: dict, current_user: User = Depends(get_current_user)):
+    template = await db.schedule_templates.find_one({"id": template_id}, {"_id": 0})
+    if not template:
+        raise HTTPException(status_code=404, detail="Schedule template not found")
+    if current_user.role != "admin" and current_user.id != template["user_id"]:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    unknown = updates.keys() - {"institution_id", "weekdays", "slots", "starts_on", "ends_on", "exceptions"}
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot update: {', '.join(sorted(unknown))}")
+    try:
+        data = ScheduleTemplateCreate(**{**template, **updates})
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=validation_message(e))
+    check_template(data)
+    
+    changes = data.model_dump(include=set(updates))
+    # A later ends_on puts a finished template back into the horizon scan
+    changes["finished"] = template_finished({**template, **changes}, template["expanded_until"])
+    await db.schedule_templates.update_one({"id": template_id}, {"$set": changes})
+    template.update(changes)
+    
+    # Diff today's and later occurrences against the new rule instead of regenerating them
+    today = utc_today()
+    existing = await db.schedules.find(
+        {"template_id": template_id, "date": {"$gte": today}},
+        {"_id": 0, "id": 1, "user_id": 1, "date": 1, "start_time": 1, "end_time": 1, "status": 1}
+    ).to_list(None)
+    current = {(day_key(s["date"]), s["start_time"], s["end_time"]): s for s in existing}
+    wanted = {
+        (day_key(day), start_time, end_time): (day, start_time, end_time)
+        for day, start_time, end_time in template_occurrences(template, today, to_datetime(template["expanded_until"]))
+    }
+    
+    dropped = [s for key, s in current.items() if key not in wanted]
+    removed = [s for s in dropped if s["status"] == "available"]
+    detached = [s for s in dropped if s["status"] != "available"]
+    now = datetime.now(timezone.utc)
+    added = [build_occurrence(template, *occurrence, now) for key, occurrence in wanted.items() if key not in current]
+    moved = []
+    if "institution_id" in changes:
+        moved = [s for key, s in current.items() if key in wanted and s["status"] == "available"]
+    
+    if removed:
+        await db.schedules.delete_many({"id": {"$in": [s["id"] for s in removed]}})
+    if detached:
+        await db.schedules.update_many({"id": {"$in": [s["id"] for s in detached]}}, {"$unset": {"template_id": ""}})
+    if added:
+        await db.schedules.insert_many(added, ordered=False)
+    if moved:
+        await db.schedules.update_many({"id": {"$in": [s["id"] for s in moved]}}, {"$set": {"institution_id": template["institution_id"]}})
+    changed = removed or detached or added or moved
+    if changed:
+        await record_changes("schedules", removed + detached + added + moved)
+    # Reopened templates (ends_on pushed back) catch up to the horizon right away
+    if not changes["finished"]:
+        template = await db.schedule_templates.find_one({"id": template_id}, {"_id": 0})
+        changed = await expand_template(template, utc_today() + timedelta(days=SCHEDULE_HORIZON_DAYS)) or changed
+    if changed:
+        await bump_versions("schedules")
+    return {
+        "message": "Schedule template updated",
+        "added": len(added),
+        "removed": len(removed),
+        "detached": len(detached),
+        "updated": len(moved)
+    }
+
+# Availability
+# A slot built by schedule_window never spans more than a day, which bounds the
+# starts_at range scanned on the (institution, status, starts_at, ends_at) index.
+MAX_SLOT_DURATION = timedelta(hours=24)
+
+async def find_overlapping(user_ids: List[str], start: datetime, end: datetime, status: str = "booked") -> List[dict]:
+    return await db.schedules.find({
+        "user_id": {"$in": user_ids},
+        "status": status,
+        "starts_at": {"$gt": start - MAX_SLOT_DURATION, "$lt": end},
+        "ends_at": {"$gt": start}
+    }, {"_id": 0}).to_list(None)
+
+@api_router.get("/availability", response_model=List[Availability])
+async def search_availability(institution_id: str, start: datetime, end: datetime, role: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    start, end = to_datetime(start), to_datetime(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    
+    await extend_schedule_templates()
+    # Slots covering the whole window
+    slots = await db.schedules.find({
+        "institution_id": institution_id,
+        "status": "available",
+        "starts_at": {"$gte": end - MAX_SLOT_DURATION, "$lte": start},
+        "ends_at": {"$gte": end}
+    }, {"_id": 0, "id": 1, "user_id": 1, "starts_at": 1, "ends_at": 1}).to_list(None)
+    if not slots:
+        return []
+    
+    user_ids = list({slot["user_id"] for slot in slots})
+    user_query = {"id": {"$in": user_ids}, "status": "approved"}
+    if role:
+        user_query["role"] = role
+    users, conflicts = await asyncio.gather(
+        db.users.find(user_query, {"_id": 0, "id": 1, "first_name": 1, "last_name": 1, "role": 1}).to_list(None),
+        find_overlapping(user_ids, start, end)
+    )
+    users = {u["id"]: u for u in users}
+    busy = {c["user_id"] for c in conflicts}
+    
+    results = {}
+    for slot in sorted(slots, key=lambda s: s["starts_at"]):
+        user = users.get(slot["user_id"])
+        if user is None or slot["user_id"] in busy or slot["user_id"] in results:
+            continue
+        results[slot["user_id"]] = Availability(
+            user_id=user["id"],
+            first_name=user["first_name"],
+            last_name=user["last_name"],
+            role=user["role"],
+            schedule_id=slot["id"],
+            institution_id=institution_id,
+            starts_at=slot["starts_at"],
+            ends_at=slot["ends_at"]
+        )
+    return list(results.values())
+
+@api_router.get("/schedules/conflicts", response_model=List[Schedule])
+async def get_schedule_conflicts(user_id: str, start: datetime, end: datetime, status: str = "booked", current_user: User = Depends(get_current_user)):
+    start, end = to_datetime(start), to_datetime(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    await extend_schedule_templates()
+    return [Schedule(**s) for s in await find_overlapping([user_id], start, end, status)]
+
+# Bulk operations
+# Items are processed in chunks of BULK_CHUNK_SIZE. With ?stream=true the
+# per-item results are streamed as NDJSON progress lines after each chunk.
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '1000'))
+
+async def bulk_response(items, handler, stream: bool, finish=None):
+    # items is a list, or an async iterator of chunks (imports parsed as they are read,
+    # whose total is only known at the end). finish(summary) runs once every chunk is
+    # processed, in both modes.
+    total = len(items) if isinstance(items, list) else None
+    
+    async def chunks():
+        if isinstance(items, list):
+            for offset in range(0, len(items), BULK_CHUNK_SIZE):
+                yield await handler(offset, items[offset:offset + BULK_CHUNK_SIZE])
+            return
+        offset = 0
+        async for chunk in items:
+            yield await handler(offset, chunk)
+            offset += len(chunk)
+    
+    def count(summary: dict, results: list):
+        for result in results:
+            summary[result["status"]] = summary.get(result["status"], 0) + 1
+    
+    if stream:
+        async def lines():
+            processed = 0
+            summary = {}
+            async for results in chunks():
+                processed += len(results)
+                count(summary, results)
+                yield json.dumps({"type": "progress", "processed": processed, "total": total, "results": results}) + "\n"
+            if finish:
+                await finish(summary)
+            yield json.dumps({"type": "summary", "total": processed, "summary": summary}) + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    
+    results = []
+    summary = {}
+    async for chunk in chunks():
+        count(summary, chunk)
+        results.extend(chunk)
+    if finish:
+        await finish(summary)
+    return {"total": len(results), "summary": summary, "results": results}
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors())
+
+# Imports
+# Onboarding imports take a JSON list or, with Content-Type: text/csv, a CSV file
+# with a header row, and run through bulk_response. The body is copied from
+# request.stream() to a temp file and parsed one chunk of rows at a time, so a
+# large file is never held in memory; it is read in full before answering since a
+# streamed response shares the request's receive channel. Admins get one summary
+# notification per import instead of one per account.
+class InvalidRow:
+    # Stands in for the first row the parser could not read; the import stops there
+    def __init__(self, error: str):
+        self.error = error
+
+def _csv_rows(text):
+    for row in csv.DictReader(text):
+        # Empty cells count as missing so optional columns fall back to their defaults
+        yield {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+
+def _json_rows(text):
+    # The items of a top-level JSON list, decoded one at a time
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    
+    def fill():
+        nonlocal buffer, pos, eof
+        data = text.read(64 * 1024)
+        eof = not data
+        buffer, pos = buffer[pos:] + data, 0
+    
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+    
+    skip_space()
+    if buffer[pos:pos + 1] != "[":
+        raise ValueError("expected a list")
+    pos += 1
+    first = True
+    while True:
+        skip_space()
+        if buffer[pos:pos + 1] == "]":
+            pos += 1
+            skip_space()
+            if pos < len(buffer):
+                raise ValueError("unexpected data after the list")
+            return
+        if not first:
+            if buffer[pos:pos + 1] != ",":
+                raise ValueError("expected ',' between items")
+            pos += 1
+            skip_space()
+        first = False
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # Positions are relative to the buffer, so only the message is kept
+                if eof:
+                    raise ValueError(e.msg)
+                fill()
+                continue
+            # A number ending the buffer may continue in the next read
+            if end == len(buffer) and not eof:
+                fill()
+                continue
+            break
+        pos = end
+        yield item
+
+def _next_rows(rows, kind: str) -> list:
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == BULK_CHUNK_SIZE:
+                break
+    except (ValueError, csv.Error) as e:
+        chunk.append(InvalidRow(f"Invalid {kind}: {e}"))
+    return chunk
+
+async def read_import(request: Request):
+    is_csv = request.headers.get("content-type", "").startswith("text/csv")
+    body = tempfile.TemporaryFile()
+    try:
+        async for data in request.stream():
+            await asyncio.to_thread(body.write, data)
+        body.seek(0)
+        text = io.TextIOWrapper(body, encoding="utf-8-sig", newline="")
+        rows = _csv_rows(text) if is_csv else _json_rows(text)
+        first = await asyncio.to_thread(_next_rows, rows, "CSV" if is_csv else "JSON")
+    except BaseException:
+        body.close()
+        raise
+    # A body that can't be read at all is rejected as a whole
+    if first and isinstance(first[0], InvalidRow):
+        body.close()
+        raise HTTPException(status_code=400, detail=first[0].error if is_csv else "Body must be a JSON list or a CSV file")
+    
+    async def chunks():
+        try:
+            chunk = first
+            while chunk:
+                yield chunk
+                if isinstance(chunk[-1], InvalidRow):
+                    return
+                chunk = await asyncio.to_thread(_next_rows, rows, "CSV" if is_csv else "JSON")
+        finally:
+            body.close()
+    
+    return chunks()
+
+def parse_import_row(model, raw):
+    if isinstance(raw, InvalidRow):
+        raise ValueError(raw.error)
+    if not isinstance(raw, dict):
+        raise ValueError("row must be an object")
+    try:
+        return model(**raw)
+    except ValidationError as e:
+        raise ValueError(validation_message(e))
+
+async def notify_import(summary: dict, what: str):
+    admins = await db.users.find({"role": "admin"}, {"_id": 0, "id": 1}).to_list(100)
+    content = f"Import {what}: {summary.get('created', 0)} créé(s), {summary.get('error', 0)} erreur(s)"
+    for admin in admins:
+        await create_notification(admin["id"], "import", content)
+
 # Shifts
-@api_router.post("/shifts", response_model=Shift)
-async def create_shift(data: ShiftCreate, current_user: User = Depends(get_current_user)):
+def build_shift(data: ShiftCreate) -> dict:
     shift_dict = data.model_dump()
     shift_dict["id"] = str(uuid.uuid4())
-    shift_dict["total"] = (data.hours * data.hourly_rate) + data.travel_cost
+    shift_dict["total"] = shift_total(data.hours, data.hourly_rate, data.travel_cost)
     shift_dict["status"] = "pending"
-    shift_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    shift_dict["created_at"] = datetime.now(timezone.utc)
+    return shift_dict
+
+@api_router.post("/shifts/bulk")
+async def create_shifts_bulk(items: List[dict], stream: bool = False, current_user: User = Depends(get_current_user)):
+    async def handler(offset: int, chunk: List[dict]) -> list:
+        results = []
+        docs = []
+        for index, raw in enumerate(chunk, start=offset):
+            try:
+                doc = build_shift(ShiftCreate(**raw))
+            except ValidationError as e:
+                results.append({"index": index, "status": "error", "error": validation_message(e)})
+                continue
+            docs.append(doc)
+            results.append({"index": index, "status": "created", "id": doc["id"]})
+        if docs:
+            await db.shifts.insert_many(docs, ordered=False)
+            await track_shift_changes([(None, doc) for doc in docs])
+            await record_changes("shifts", docs)
+        return results
     
+    return await bulk_response(items, handler, stream)
+
+@api_router.patch("/shifts/bulk-status")
+async def update_shift_status_bulk(data: ShiftStatusBulk, stream: bool = False, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    async def handler(offset: int, chunk: List[str]) -> list:
+        existing = await db.shifts.find({"id": {"$in": chunk}}, {"_id": 0}).to_list(None)
+        found = {shift["id"]: shift for shift in existing}
+        if found:
+            await db.shifts.update_many({"id": {"$in": list(found)}}, {"$set": {"status": data.status}})
+            await track_shift_changes([(shift, {**shift, "status": data.status}) for shift in found.values()])
+            await record_changes("shifts", list(found.values()))
+        return [
+            {"index": index, "id": shift_id, "status": "updated" if shift_id in found else "not_found"}
+            for index, shift_id in enumerate(chunk, start=offset)
+        ]
+    
+    return await bulk_response(data.shift_ids, handler, stream)
+
+@api_router.post("/shifts", response_model=Shift)
+async def create_shift(data: ShiftCreate, current_user: User = Depends(get_current_user)):
+    shift_dict = build_shift(data)
     await db.shifts.insert_one(shift_dict)
+    await track_shift_change(None, shift_dict)
+    await record_changes("shifts", [shift_dict])
     return Shift(**shift_dict)
 
 @api_router.get("/shifts", response_model=List[Shift])
-async def get_shifts(user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_shifts(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
     query = {}
     if user_id:
         query["user_id"] = user_id
     elif current_user.role != "admin":
         query["user_id"] = current_user.id
     
-    shifts = await db.shifts.find(query, {"_id": 0}).to_list(1000)
-    return [Shift(**s) for s in shifts]
+    shifts = await fetch_page(db.shifts, query, response, limit, after, projection=encoder_for(Shift).projection)
+    return list_response(Shift, shifts, response)
 
 @api_router.patch("/shifts/{shift_id}/status")
 async def update_shift_status(shift_id: str, status: str, current_user: User = Depends(get_current_user)):
-    result = await db.shifts.update_one({"id": shift_id}, {"$set": {"status": status}})
-    if result.matched_count == 0:
+    before = await db.shifts.find_one_and_update({"id": shift_id}, {"$set": {"status": status}}, {"_id": 0})
+    if before is None:
         raise HTTPException(status_code=404, detail="Shift not found")
+    await track_shift_change(before, {**before, "status": status})
+    await record_changes("shifts", [before])
     return {"message": "Shift status updated"}
 
 # Payslips
@@ -359,49 +2635,461 @@ async def generate_payslip(user_id: str, period: str, current_user: User = Depen
         raise HTTPException(status_code=403, detail="Unauthorized")
     
     # Get validated shifts for the period
+    start, end = period_range(period)
     shifts = await db.shifts.find({
         "user_id": user_id,
         "status": "validated",
-        "date": {"$regex": f"^{period}"}
+        "date": {"$gte": start, "$lt": end}
     }, {"_id": 0}).to_list(1000)
     
     if not shifts:
         raise HTTPException(status_code=404, detail="No validated shifts for this period")
     
     gross_total = sum(s["total"] for s in shifts)
-    commission = gross_total * 0.07
-    net_total = gross_total - commission
-    
-    payslip = {
-        "id": str(uuid.uuid4()),
-        "user_id": user_id,
-        "period": period,
-        "shifts": [s["id"] for s in shifts],
-        "gross_total": gross_total,
-        "commission": commission,
-        "net_total": net_total,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
+    payslip = build_payslip(user_id, period, [s["id"] for s in shifts], gross_total)
     
     await db.payslips.insert_one(payslip)
     await db.shifts.update_many(
         {"id": {"$in": payslip["shifts"]}},
         {"$set": {"status": "paid"}}
     )
+    await bump_counters(f"user:{user_id}", {"total_earned": gross_total, "pending_amount": -gross_total})
+    await record_changes("payslips", [payslip])
+    await record_changes("shifts", shifts)
     
     await create_notification(user_id, "payslip", f"Nouvelle fiche de paie pour {period}")
     return Payslip(**payslip)
 
+# Payroll runs
+# One run per period at a time: a run holds the payroll_locks document of its
+# period and refreshes its heartbeat after every batch. A lock whose heartbeat is
+# older than PAYROLL_STALE_SECONDS belongs to a dead process and can be taken over.
+PAYROLL_BATCH_SIZE = int(os.environ.get('PAYROLL_BATCH_SIZE', '500'))
+PAYROLL_STALE_SECONDS = float(os.environ.get('PAYROLL_STALE_SECONDS', '600'))
+payroll_tasks = set()
+
+async def _save_run(run: dict):
+    await db.payroll_runs.update_one({"id": run["id"]}, {"$set": run}, upsert=True)
+    if run["status"] == "running":
+        await db.payroll_locks.update_one(
+            {"id": run["period"], "run_id": run["id"]},
+            {"$set": {"heartbeat": datetime.now(timezone.utc)}}
+        )
+
+async def acquire_payroll_lock(period: str, run_id: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        await db.payroll_locks.insert_one({"id": period, "run_id": run_id, "heartbeat": now})
+        return True
+    except DuplicateKeyError:
+        pass
+    stale = await db.payroll_locks.find_one_and_update(
+        {"id": period, "heartbeat": {"$lt": now - timedelta(seconds=PAYROLL_STALE_SECONDS)}},
+        {"$set": {"run_id": run_id, "heartbeat": now}},
+        {"_id": 0, "run_id": 1}
+    )
+    if stale is None:
+        return False
+    await db.payroll_runs.update_one({"id": stale["run_id"], "status": "running"}, {"$set": {"status": "interrupted"}})
+    return True
+
+async def release_payroll_lock(run: dict):
+    await db.payroll_locks.delete_one({"id": run["period"], "run_id": run["id"]})
+
+async def mark_interrupted_runs():
+    # Runs whose process died without releasing the lock (or whose lock was taken over)
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=PAYROLL_STALE_SECONDS)
+    live = await db.payroll_locks.distinct("run_id", {"heartbeat": {"$gte": cutoff}})
+    result = await db.payroll_runs.update_many(
+        {"status": "running", "id": {"$nin": live}},
+        {"$set": {"status": "interrupted"}}
+    )
+    return result.modified_count
+
+async def _payroll_batch(run: dict, groups: List[dict]):
+    period = run["period"]
+    user_ids = [g["_id"] for g in groups]
+    existing = await db.payslips.find(
+        {"period": period, "user_id": {"$in": user_ids}},
+        {"_id": 0, "user_id": 1, "shifts": 1}
+    ).to_list(None)
+    
+    # Shifts already on a payslip of this period are not paid twice; they are only
+    # flipped again in case a previous run stopped halfway. Shifts validated since
+    # the user's last payslip go on a supplementary one.
+    on_payslip = {shift_id for p in existing for shift_id in p["shifts"]}
+    already_paid = {p["user_id"] for p in existing}
+    shift_ids = list(on_payslip)
+    payslips = []
+    counters = {}
+    for group in groups:
+        new_shifts = [s for s in group["shifts"] if s["id"] not in on_payslip]
+        run["skipped_amount"] += sum(s["total"] for s in group["shifts"] if s["id"] in on_payslip)
+        if not new_shifts:
+            continue
+        gross_total = sum(s["total"] for s in new_shifts)
+        payslips.append(build_payslip(group["_id"], period, [s["id"] for s in new_shifts], gross_total))
+        shift_ids.extend(s["id"] for s in new_shifts)
+        counters[f"user:{group['_id']}"] = {"total_earned": gross_total, "pending_amount": -gross_total}
+    
+    if payslips:
+        await db.payslips.insert_many(payslips, ordered=False)
+    if shift_ids:
+        result = await db.shifts.update_many(
+            {"id": {"$in": shift_ids}, "status": "validated"},
+            {"$set": {"status": "paid"}}
+        )
+        run["shifts_paid"] += result.modified_count
+        owners = {shift_id: p["user_id"] for p in existing for shift_id in p["shifts"]}
+        owners.update((shift_id, p["user_id"]) for p in payslips for shift_id in p["shifts"])
+        await record_changes("shifts", [{"id": shift_id, "user_id": user_id} for shift_id, user_id in owners.items()])
+    if payslips:
+        await record_changes("payslips", payslips)
+        notifications = [
+            build_notification(
+                p["user_id"], "payslip",
+                f"Fiche de paie complémentaire pour {period}" if p["user_id"] in already_paid else f"Nouvelle fiche de paie pour {period}"
+            )
+            for p in payslips
+        ]
+        # Through the outbox, so clients get the push once each row is written
+        for notification in notifications:
+            await notification_outbox.put(notification)
+    await bump_counters_many(counters)
+    
+    run["payslips_created"] += len(payslips)
+    run["supplementary_payslips"] += sum(1 for p in payslips if p["user_id"] in already_paid)
+    run["skipped_users"] += len(groups) - len(payslips)
+    run["processed_users"] += len(groups)
+
+async def execute_payroll_run(run: dict):
+    started = time.monotonic()
+    start, end = period_range(run["period"])
+    try:
+        groups = await db.shifts.aggregate([
+            {"$match": {"status": "validated", "date": {"$gte": start, "$lt": end}}},
+            {"$group": {"_id": "$user_id", "shifts": {"$push": {"id": "$id", "total": "$total"}}}},
+            {"$sort": {"_id": 1}}
+        ]).to_list(None)
+        run["total_users"] = len(groups)
+        await _save_run(run)
+        
+        for i in range(0, len(groups), PAYROLL_BATCH_SIZE):
+            await _payroll_batch(run, groups[i:i + PAYROLL_BATCH_SIZE])
+            elapsed = time.monotonic() - started
+            run["elapsed_seconds"] = elapsed
+            run["payslips_per_second"] = run["payslips_created"] / elapsed if elapsed else 0.0
+            await _save_run(run)
+        
+        run["status"] = "completed"
+    except asyncio.CancelledError:
+        # Shutdown; rerunning the period picks up the users not paid yet
+        run["status"] = "interrupted"
+        raise
+    except Exception as e:
+        logger.exception(f"Payroll run {run['id']} failed")
+        run["status"] = "failed"
+        run["error"] = str(e)
+    finally:
+        run["elapsed_seconds"] = time.monotonic() - started
+        run["finished_at"] = datetime.now(timezone.utc)
+        await _save_run(run)
+        await release_payroll_lock(run)
+
+@api_router.post("/payslips/run")
+async def start_payroll_run(period: str, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    period_range(period)
+    
+    run = {
+        "id": str(uuid.uuid4()),
+        "period": period,
+        "status": "running",
+        "total_users": None,
+        "processed_users": 0,
+        "payslips_created": 0,
+        "supplementary_payslips": 0,
+        "skipped_users": 0,
+        "skipped_amount": 0.0,
+        "shifts_paid": 0,
+        "elapsed_seconds": 0.0,
+        "payslips_per_second": 0.0,
+        "started_at": datetime.now(timezone.utc),
+        "finished_at": None,
+        "error": None
+    }
+    if not await acquire_payroll_lock(period, run["id"]):
+        raise HTTPException(status_code=409, detail=f"A payroll run for {period} is already in progress")
+    await _save_run(run)
+    
+    task = asyncio.create_task(execute_payroll_run(run))
+    payroll_tasks.add(task)
+    task.add_done_callback(payroll_tasks.discard)
+    return dict(run)
+
+@api_router.get("/payslips/runs/{run_id}")
+async def get_payroll_run(run_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    run = await db.payroll_runs.find_one({"id": run_id}, {"_id": 0})
+    if not run:
+        raise HTTPException(status_code=404, detail="Payroll run not found")
+    return run
+
+@api_router.get("/payslips/{payslip_id}/pdf")
+async def get_payslip_pdf(payslip_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    if pdf_canvas is None:
+        raise HTTPException(status_code=501, detail="PDF rendering requires ReportLab")
+    payslip = await db.payslips.find_one({"id": payslip_id}, {"_id": 0})
+    if not payslip:
+        raise HTTPException(status_code=404, detail="Payslip not found")
+    if current_user.role != "admin" and payslip["user_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    document = await payslip_document(payslip)
+    digest = payslip_digest(document)
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    path = await render_payslip(document, digest)
+    headers["Content-Disposition"] = f'attachment; filename="fiche-de-paie-{payslip["period"]}.pdf"'
+    return FileResponse(path, media_type="application/pdf", headers=headers)
+
 @api_router.get("/payslips", response_model=List[Payslip])
-async def get_payslips(user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_payslips(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
     query = {}
     if user_id:
         query["user_id"] = user_id
     elif current_user.role != "admin":
         query["user_id"] = current_user.id
     
-    payslips = await db.payslips.find(query, {"_id": 0}).to_list(1000)
-    return [Payslip(**p) for p in payslips]
+    payslips = await fetch_page(db.payslips, query, response, limit, after, projection=encoder_for(Payslip).projection)
+    return list_response(Payslip, payslips, response)
+
+# Conversations
+# One summary document per pair of users, kept up to date by send_message and
+# mark_message_read, so the inbox never scans the message history.
+def conversation_id(user_a: str, user_b: str) -> str:
+    return ":".join(sorted([user_a, user_b]))
+
+def conversation_view(conversation: dict, user_id: str) -> Conversation:
+    other = [p for p in conversation["participants"] if p != user_id]
+    return Conversation(
+        id=conversation["id"],
+        other_user_id=other[0] if other else user_id,
+        last_message_id=conversation["last_message"]["id"],
+        last_sender_id=conversation["last_message"]["sender_id"],
+        last_message=conversation["last_message"]["content"],
+        last_activity=conversation["last_activity"],
+        unread_count=conversation.get("unread", {}).get(user_id, 0)
+    )
+
+async def record_conversation_message(message: dict):
+    await db.conversations.update_one(
+        {"id": conversation_id(message["sender_id"], message["recipient_id"])},
+        {
+            "$set": {
+                "participants": sorted({message["sender_id"], message["recipient_id"]}),
+                "last_message": {k: message[k] for k in ("id", "sender_id", "content", "timestamp")},
+                "last_activity": message["timestamp"]
+            },
+            "$inc": {f"unread.{message['recipient_id']}": 1}
+        },
+        upsert=True
+    )
+
+async def rebuild_conversations():
+    pair = {"$cond": [
+        {"$lt": ["$sender_id", "$recipient_id"]},
+        {"$concat": ["$sender_id", ":", "$recipient_id"]},
+        {"$concat": ["$recipient_id", ":", "$sender_id"]}
+    ]}
+    # Both passes cover the whole collection, past the 100MB in-memory stage limit
+    latest, unread = await asyncio.gather(
+        db.messages.aggregate([
+            {"$project": {"_id": 0, "id": 1, "sender_id": 1, "recipient_id": 1, "content": 1, "timestamp": 1}},
+            {"$sort": {"timestamp": 1}},
+            {"$group": {"_id": pair, "last": {"$last": "$$ROOT"}}}
+        ], allowDiskUse=True).to_list(None),
+        db.messages.aggregate([
+            {"$match": {"read": False}},
+            {"$group": {"_id": {"pair": pair, "recipient_id": "$recipient_id"}, "count": {"$sum": 1}}}
+        ], allowDiskUse=True).to_list(None)
+    )
+    unread_by_pair = {}
+    for row in unread:
+        unread_by_pair.setdefault(row["_id"]["pair"], {})[row["_id"]["recipient_id"]] = row["count"]
+    
+    docs = []
+    for row in latest:
+        last = row["last"]
+        docs.append({
+            "id": row["_id"],
+            "participants": sorted(set(row["_id"].split(":"))),
+            "last_message": {k: last[k] for k in ("id", "sender_id", "content", "timestamp")},
+            "last_activity": last["timestamp"],
+            "unread": unread_by_pair.get(row["_id"], {})
+        })
+    await db.conversations.delete_many({})
+    if docs:
+        await db.conversations.insert_many(docs)
+
+@api_router.get("/conversations", response_model=List[Conversation])
+async def get_conversations(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    conversations = await fetch_page(
+        db.conversations, {"participants": current_user.id}, response, limit, after,
+        sort_field="last_activity", direction=DESCENDING
+    )
+    return [conversation_view(c, current_user.id) for c in conversations]
+
+# Exports
+# Rows are read from the Motor cursor and written out as they arrive, so an
+# export never holds more than one batch in memory. XLSX needs XlsxWriter.
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+SHIFT_EXPORT_COLUMNS = ["id", "user_id", "institution_id", "date", "hours", "hourly_rate", "travel_cost", "total", "status", "created_at"]
+PAYSLIP_EXPORT_COLUMNS = ["id", "user_id", "period", "shift_count", "gross_total", "commission", "net_total", "created_at"]
+
+def _export_date(value) -> str:
+    try:
+        return to_datetime(value).isoformat()
+    except ValueError:
+        return str(value)
+
+def shift_export_row(shift: dict) -> list:
+    travel_cost = shift.get("travel_cost", 0.0)
+    return [
+        shift["id"], shift["user_id"], shift["institution_id"], _export_date(shift["date"])[:10],
+        shift["hours"], shift["hourly_rate"], travel_cost,
+        round(shift_total(shift["hours"], shift["hourly_rate"], travel_cost), 2),
+        shift["status"], _export_date(shift["created_at"])
+    ]
+
+def payslip_export_row(payslip: dict) -> list:
+    commission, net_total = payslip_amounts(payslip["gross_total"])
+    return [
+        payslip["id"], payslip["user_id"], payslip["period"], len(payslip["shifts"]),
+        round(payslip["gross_total"], 2), round(commission, 2), round(net_total, 2),
+        _export_date(payslip["created_at"])
+    ]
+
+async def _csv_chunks(cursor, columns: list, row_fn):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    rows = 0
+    async for doc in cursor:
+        writer.writerow(row_fn(doc))
+        rows += 1
+        if rows % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+def _write_xlsx_rows(worksheet, first_row: int, rows: list):
+    for offset, row in enumerate(rows):
+        worksheet.write_row(first_row + offset, 0, row)
+
+async def _xlsx_chunks(cursor, columns: list, row_fn, sheet: str):
+    # constant_memory flushes each row to disk; the finished file is then streamed
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        worksheet = workbook.add_worksheet(sheet)
+        worksheet.write_row(0, 0, columns)
+        next_row = 1
+        batch = []
+        async for doc in cursor:
+            batch.append(row_fn(doc))
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                await asyncio.to_thread(_write_xlsx_rows, worksheet, next_row, batch)
+                next_row += len(batch)
+                batch = []
+        await asyncio.to_thread(_write_xlsx_rows, worksheet, next_row, batch)
+        await asyncio.to_thread(workbook.close)
+        
+        with open(path, "rb") as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, 64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+async def _payslips_at_institution(cursor, institution_id: str):
+    # Payslips don't store an institution; keep those covering a shift worked there,
+    # looked up one batch of payslips at a time
+    async def flush(batch: list):
+        shift_ids = [shift_id for payslip in batch for shift_id in payslip.get("shifts", [])]
+        matched = set(await db.shifts.distinct("id", {"id": {"$in": shift_ids}, "institution_id": institution_id}))
+        return [payslip for payslip in batch if matched.intersection(payslip.get("shifts", []))]
+    
+    batch = []
+    async for payslip in cursor:
+        batch.append(payslip)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            for match in await flush(batch):
+                yield match
+            batch = []
+    if batch:
+        for match in await flush(batch):
+            yield match
+
+def export_response(cursor, export_format: str, columns: list, row_fn, name: str) -> StreamingResponse:
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be csv or xlsx")
+    if export_format == "xlsx":
+        if xlsxwriter is None:
+            raise HTTPException(status_code=501, detail="XLSX export requires XlsxWriter")
+        body = _xlsx_chunks(cursor, columns, row_fn, name.split("-")[0])
+    else:
+        body = _csv_chunks(cursor, columns, row_fn)
+    return StreamingResponse(body, media_type=EXPORT_FORMATS[export_format], headers={
+        "Content-Disposition": f'attachment; filename="{name}.{export_format}"'
+    })
+
+@api_router.get("/export/shifts")
+async def export_shifts(format: str = "csv", period: Optional[str] = None, institution_id: Optional[str] = None,
+                        user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    query = {}
+    if current_user.role != "admin":
+        query["user_id"] = current_user.id
+    elif user_id:
+        query["user_id"] = user_id
+    if institution_id:
+        query["institution_id"] = institution_id
+    if period:
+        start, end = period_range(period)
+        query["date"] = {"$gte": start, "$lt": end}
+    
+    cursor = db.shifts.find(query, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE)
+    return export_response(cursor, format, SHIFT_EXPORT_COLUMNS, shift_export_row, f"shifts-{period or 'all'}")
+
+@api_router.get("/export/payslips")
+async def export_payslips(format: str = "csv", period: Optional[str] = None, institution_id: Optional[str] = None,
+                          user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    query = {}
+    if current_user.role != "admin":
+        query["user_id"] = current_user.id
+    elif user_id:
+        query["user_id"] = user_id
+    if period:
+        period_range(period)
+        query["period"] = period
+    
+    cursor = db.payslips.find(query, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE)
+    if institution_id:
+        cursor = _payslips_at_institution(cursor, institution_id)
+    return export_response(cursor, format, PAYSLIP_EXPORT_COLUMNS, payslip_export_row, f"payslips-{period or 'all'}")
 
 # Messages
 @api_router.post("/messages", response_model=Message)
@@ -409,16 +3097,21 @@ async def send_message(data: MessageCreate, current_user: User = Depends(get_cur
     message_dict = data.model_dump()
     message_dict["id"] = str(uuid.uuid4())
     message_dict["sender_id"] = current_user.id
-    message_dict["timestamp"] = datetime.now(timezone.utc).isoformat()
+    message_dict["timestamp"] = datetime.now(timezone.utc)
     message_dict["read"] = False
     
     await db.messages.insert_one(message_dict)
+    await record_conversation_message(message_dict)
+    await bump_versions(*version_scopes("messages", [current_user.id, data.recipient_id]))
+    message = Message(**message_dict)
+    event_hub.publish(data.recipient_id, "message", message.model_dump(mode="json"))
+    event_hub.publish(current_user.id, "message", message.model_dump(mode="json"))
     await create_notification(data.recipient_id, "message", f"Nouveau message de {current_user.first_name} {current_user.last_name}")
     
-    return Message(**message_dict)
+    return message
 
 @api_router.get("/messages", response_model=List[Message])
-async def get_messages(other_user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def get_messages(request: Request, response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, other_user_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
     if other_user_id:
         query = {
             "$or": [
@@ -434,44 +3127,84 @@ async def get_messages(other_user_id: Optional[str] = None, current_user: User =
             ]
         }
     
-    messages = await db.messages.find(query, {"_id": 0}).sort("timestamp", 1).to_list(1000)
-    return [Message(**m) for m in messages]
+    cached = await not_modified(request, response, current_user, f"messages:{current_user.id}")
+    if cached:
+        return cached
+    messages = await fetch_page(db.messages, query, response, limit, after, sort_field="timestamp", projection=encoder_for(Message).projection)
+    return list_response(Message, messages, response)
 
 @api_router.patch("/messages/{message_id}/read")
 async def mark_message_read(message_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.messages.update_one(
+    before = await db.messages.find_one_and_update(
         {"id": message_id, "recipient_id": current_user.id},
-        {"$set": {"read": True}}
+        {"$set": {"read": True}},
+        {"_id": 0, "sender_id": 1, "read": 1}
     )
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail="Message not found")
+    if not before.get("read"):
+        unread_field = f"unread.{current_user.id}"
+        await db.conversations.update_one(
+            {"id": conversation_id(before["sender_id"], current_user.id), unread_field: {"$gt": 0}},
+            {"$inc": {unread_field: -1}}
+        )
+        await bump_versions(*version_scopes("messages", [before["sender_id"], current_user.id]))
     return {"message": "Message marked as read"}
 
 # Notifications
+def notification_expiry_bucket() -> str:
+    # The TTL monitor deletes without bumping any version, so with the TTL index the
+    # list ETag also rolls over with the monitor's 60s period
+    return str(int(time.time() // 60)) if NOTIFICATION_TTL else ""
+
 @api_router.get("/notifications", response_model=List[Notification])
-async def get_notifications(current_user: User = Depends(get_current_user)):
+async def get_notifications(request: Request, response: Response, current_user: User = Depends(get_current_user)):
+    cached = await not_modified(request, response, current_user, f"notifications:{current_user.id}", salt=notification_expiry_bucket())
+    if cached:
+        return cached
     notifications = await db.notifications.find(
         {"user_id": current_user.id},
-        {"_id": 0}
+        encoder_for(Notification).projection
     ).sort("timestamp", -1).to_list(100)
-    return [Notification(**n) for n in notifications]
+    return list_response(Notification, notifications, response)
+
+@api_router.get("/notifications/unread-count")
+async def get_unread_notification_count(current_user: User = Depends(get_current_user)):
+    counter = await db.notification_counters.find_one({"id": current_user.id}, {"_id": 0, "unread": 1})
+    return {"unread": max(counter["unread"], 0) if counter else 0}
 
 @api_router.patch("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: User = Depends(get_current_user)):
     result = await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user.id},
-        {"$set": {"read": True}}
+        {"id": notification_id, "user_id": current_user.id, "read": False},
+        {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}}
     )
     if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Notification not found")
+        if not await db.notifications.find_one({"id": notification_id, "user_id": current_user.id}, {"_id": 0, "id": 1}):
+            raise HTTPException(status_code=404, detail="Notification not found")
+    else:
+        await db.notification_counters.update_one(
+            {"id": current_user.id, "unread": {"$gt": 0}},
+            {"$inc": {"unread": -1}}
+        )
+        await bump_versions(f"notifications:{current_user.id}")
+        await record_changes("notifications", [{"id": notification_id, "user_id": current_user.id}])
     return {"message": "Notification marked as read"}
 
 @api_router.patch("/notifications/read-all")
 async def mark_all_notifications_read(current_user: User = Depends(get_current_user)):
-    await db.notifications.update_many(
-        {"user_id": current_user.id},
-        {"$set": {"read": True}}
+    ids = await db.notifications.distinct("id", {"user_id": current_user.id, "read": False})
+    result = await db.notifications.update_many(
+        {"id": {"$in": ids}, "read": False},
+        {"$set": {"read": True, "read_at": datetime.now(timezone.utc)}}
     )
+    if result.modified_count:
+        await db.notification_counters.update_one(
+            {"id": current_user.id},
+            {"$inc": {"unread": -result.modified_count}}
+        )
+        await bump_versions(f"notifications:{current_user.id}")
+        await record_changes("notifications", [{"id": notification_id, "user_id": current_user.id} for notification_id in ids])
     return {"message": "All notifications marked as read"}
 
 # Shift Exchanges
@@ -487,22 +3220,23 @@ async def create_exchange(data: ShiftExchangeCreate, current_user: User = Depend
     exchange_dict["id"] = str(uuid.uuid4())
     exchange_dict["from_user_id"] = current_user.id
     exchange_dict["status"] = "pending"
-    exchange_dict["created_at"] = datetime.now(timezone.utc).isoformat()
+    exchange_dict["created_at"] = datetime.now(timezone.utc)
     
     await db.shift_exchanges.insert_one(exchange_dict)
+    await record_changes("exchanges", [exchange_dict])
     await create_notification(data.to_user_id, "exchange", f"Demande d'échange de prestation de {current_user.first_name}")
     
     return ShiftExchange(**exchange_dict)
 
 @api_router.get("/exchanges", response_model=List[ShiftExchange])
-async def get_exchanges(current_user: User = Depends(get_current_user)):
-    exchanges = await db.shift_exchanges.find({
+async def get_exchanges(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    exchanges = await fetch_page(db.shift_exchanges, {
         "$or": [
             {"from_user_id": current_user.id},
             {"to_user_id": current_user.id}
         ]
-    }, {"_id": 0}).to_list(1000)
-    return [ShiftExchange(**e) for e in exchanges]
+    }, response, limit, after, projection=encoder_for(ShiftExchange).projection)
+    return list_response(ShiftExchange, exchanges, response)
 
 @api_router.patch("/exchanges/{exchange_id}")
 async def update_exchange(exchange_id: str, status: str, current_user: User = Depends(get_current_user)):
@@ -513,64 +3247,473 @@ async def update_exchange(exchange_id: str, status: str, current_user: User = De
         raise HTTPException(status_code=403, detail="Unauthorized")
     
     await db.shift_exchanges.update_one({"id": exchange_id}, {"$set": {"status": status}})
+    await record_changes("exchanges", [exchange])
     
     if status == "accepted":
-        await db.shifts.update_one(
+        before = await db.shifts.find_one_and_update(
             {"id": exchange["shift_id"]},
-            {"$set": {"user_id": current_user.id}}
+            {"$set": {"user_id": current_user.id}},
+            {"_id": 0}
         )
+        if before is not None:
+            await track_shift_change(before, {**before, "user_id": current_user.id})
+            await record_changes("shifts", [before, {**before, "user_id": current_user.id}])
         await create_notification(exchange["from_user_id"], "exchange", "Votre demande d'échange a été acceptée")
     elif status == "rejected":
         await create_notification(exchange["from_user_id"], "exchange", "Votre demande d'échange a été refusée")
     
     return {"message": f"Exchange {status}"}
 
+# Sync
+@api_router.get("/sync")
+async def get_sync(since: Optional[int] = None, limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=SYNC_PAGE_SIZE), current_user: User = Depends(get_current_user)):
+    await extend_schedule_templates()
+    head = await db.versions.find_one({"id": "sync"}, {"_id": 0, "version": 1})
+    head = head["version"] if head else 0
+    # Without a cursor, return the current one; the client loads its lists after this call
+    if since is None:
+        return {"cursor": head, "changes": [], "has_more": False}
+    
+    oldest = await db.sync_changes.find_one({}, {"_id": 0, "seq": 1}, sort=[("seq", ASCENDING)])
+    floor = oldest["seq"] - 1 if oldest else head
+    if since < floor or since > head:
+        raise HTTPException(status_code=410, detail="Sync cursor expired, reload")
+    return await sync_changes_since(since, limit, current_user)
+
+# Events
+@api_router.get("/events/stream")
+async def stream_events(request: Request, token: Optional[str] = None, cursor: Optional[str] = None):
+    # EventSource can't send headers, so the token may also come as a query parameter
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    current_user = await authenticate_token(token)
+    cursor = request.headers.get("last-event-id") or cursor
+    
+    subscriber = event_hub.subscribe(current_user.id)
+    backlog = event_hub.replay(current_user.id, cursor)
+    
+    async def events():
+        try:
+            if backlog is None:
+                yield f"id: {event_hub.epoch}:{event_hub.seq.get(current_user.id, 0)}\nevent: resync\ndata: {{}}\n\n"
+            else:
+                for event in backlog:
+                    yield format_sse(event)
+            while not subscriber.lagged:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # The token is checked again so expiry and revocation also end open streams
+                    try:
+                        await authenticate_token(token)
+                    except HTTPException:
+                        yield "event: reauth\ndata: {}\n\n"
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+            # The client fell too far behind; it reconnects and replays from its cursor
+            yield "event: resync\ndata: {}\n\n"
+        finally:
+            event_hub.unsubscribe(current_user.id, subscriber)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 # Dashboard Stats
+async def _first(cursor) -> dict:
+    docs = await cursor.to_list(1)
+    return docs[0] if docs else {}
+
+async def compute_global_stats() -> dict:
+    thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
+    users, total_institutions, shifts = await asyncio.gather(
+        _first(db.users.aggregate([
+            {"$group": {
+                "_id": None,
+                "total_users": {"$sum": 1},
+                "pending_users": {"$sum": {"$cond": [{"$eq": ["$status", "pending"]}, 1, 0]}}
+            }}
+        ])),
+        db.institutions.count_documents({}),
+        _first(db.shifts.aggregate([
+            {"$facet": {
+                "counts": [{"$group": {
+                    "_id": None,
+                    "total_shifts": {"$sum": 1},
+                    "pending_shifts": {"$sum": {"$cond": [{"$eq": ["$status", "pending"]}, 1, 0]}}
+                }}],
+                "recent": [
+                    {"$match": {"created_at": {"$gte": thirty_days_ago}}},
+                    {"$group": {"_id": None, "recent_revenue": {"$sum": "$total"}}}
+                ]
+            }}
+        ]))
+    )
+    counts = shifts["counts"][0] if shifts.get("counts") else {}
+    recent = shifts["recent"][0] if shifts.get("recent") else {}
+    return {
+        "total_users": users.get("total_users", 0),
+        "pending_users": users.get("pending_users", 0),
+        "total_institutions": total_institutions,
+        "total_shifts": counts.get("total_shifts", 0),
+        "pending_shifts": counts.get("pending_shifts", 0),
+        "recent_revenue": recent.get("recent_revenue", 0)
+    }
+
+USER_SHIFT_TOTALS = {
+    "total_shifts": {"$sum": 1},
+    "total_hours": {"$sum": "$hours"},
+    "total_earned": {"$sum": {"$cond": [{"$eq": ["$status", "paid"]}, "$total", 0]}},
+    "pending_amount": {"$sum": {"$cond": [{"$in": ["$status", ["pending", "validated"]]}, "$total", 0]}}
+}
+
+async def compute_user_stats(user_id: str) -> dict:
+    totals = await _first(db.shifts.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": None, **USER_SHIFT_TOTALS}}
+    ]))
+    return {field: totals.get(field, 0) for field in USER_SHIFT_TOTALS}
+
+async def rebuild_dashboard_counters():
+    cutoff = datetime.now(timezone.utc) - timedelta(days=31)
+    global_stats, daily, per_user = await asyncio.gather(
+        compute_global_stats(),
+        db.shifts.aggregate([
+            {"$match": {"created_at": {"$gte": cutoff}}},
+            {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, "revenue": {"$sum": "$total"}}}
+        ]).to_list(None),
+        db.shifts.aggregate([
+            {"$group": {"_id": "$user_id", **USER_SHIFT_TOTALS}}
+        ]).to_list(None)
+    )
+    global_stats.pop("recent_revenue")
+    global_stats["daily_revenue"] = {d["_id"]: d["revenue"] for d in daily}
+    
+    # Upserts rather than delete + insert, so concurrent startups can't collide on id_unique
+    docs = {"global": global_stats}
+    docs.update((f"user:{u.pop('_id')}", u) for u in per_user)
+    await db.dashboard_counters.bulk_write([
+        UpdateOne({"id": counter_id}, {"$set": values}, upsert=True)
+        for counter_id, values in docs.items()
+    ], ordered=False)
+    # Users whose shifts are all gone
+    await db.dashboard_counters.update_many(
+        {"id": {"$regex": "^user:", "$nin": list(docs)}},
+        {"$set": {field: 0 for field in USER_SHIFT_TOTALS}}
+    )
+
+@api_router.post("/admin/dashboard-counters/rebuild")
+async def rebuild_dashboard_counters_route(current_user: User = Depends(get_current_user)):
+    # For counters left stale while DASHBOARD_COUNTERS was off
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if not DASHBOARD_COUNTERS:
+        raise HTTPException(status_code=400, detail="Dashboard counters are disabled")
+    await rebuild_dashboard_counters()
+    return {"message": "Dashboard counters rebuilt"}
+
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
     if current_user.role == "admin":
-        total_users = await db.users.count_documents({})
-        pending_users = await db.users.count_documents({"status": "pending"})
-        total_institutions = await db.institutions.count_documents({})
-        total_shifts = await db.shifts.count_documents({})
-        pending_shifts = await db.shifts.count_documents({"status": "pending"})
-        
-        # Recent shifts total
-        from datetime import datetime, timedelta
-        thirty_days_ago = (datetime.now(timezone.utc) - timedelta(days=30)).isoformat()
-        recent_shifts = await db.shifts.find(
-            {"created_at": {"$gte": thirty_days_ago}},
-            {"_id": 0}
-        ).to_list(1000)
-        recent_total = sum(s["total"] for s in recent_shifts)
+        if not DASHBOARD_COUNTERS:
+            return await compute_global_stats()
         
+        counters = await db.dashboard_counters.find_one({"id": "global"}, {"_id": 0}) or {}
+        cutoff = day_key(datetime.now(timezone.utc) - timedelta(days=30))
         return {
-            "total_users": total_users,
-            "pending_users": pending_users,
-            "total_institutions": total_institutions,
-            "total_shifts": total_shifts,
-            "pending_shifts": pending_shifts,
-            "recent_revenue": recent_total
+            "total_users": counters.get("total_users", 0),
+            "pending_users": counters.get("pending_users", 0),
+            "total_institutions": counters.get("total_institutions", 0),
+            "total_shifts": counters.get("total_shifts", 0),
+            "pending_shifts": counters.get("pending_shifts", 0),
+            "recent_revenue": sum(v for day, v in counters.get("daily_revenue", {}).items() if day >= cutoff)
         }
     else:
-        user_shifts = await db.shifts.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-        total_hours = sum(s["hours"] for s in user_shifts)
-        total_earned = sum(s["total"] for s in user_shifts if s["status"] == "paid")
-        pending_amount = sum(s["total"] for s in user_shifts if s["status"] in ["pending", "validated"])
-        
-        unread_messages = await db.messages.count_documents({
+        unread_query = db.messages.count_documents({
             "recipient_id": current_user.id,
             "read": False
         })
+        if DASHBOARD_COUNTERS:
+            counters, unread_messages = await asyncio.gather(
+                db.dashboard_counters.find_one({"id": f"user:{current_user.id}"}, {"_id": 0}),
+                unread_query
+            )
+            stats = {field: (counters or {}).get(field, 0) for field in USER_SHIFT_TOTALS}
+        else:
+            stats, unread_messages = await asyncio.gather(compute_user_stats(current_user.id), unread_query)
+        
+        return {**stats, "unread_messages": unread_messages}
+
+@app.get("/metrics")
+async def get_metrics(request: Request):
+    token = os.environ.get('METRICS_TOKEN')
+    # Per-route and per-collection traffic is not public
+    if not token:
+        raise HTTPException(status_code=403, detail="Metrics are disabled, set METRICS_TOKEN")
+    if request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Long-lived streams would swamp the latency histogram and in-flight gauge; they
+# are counted as open streams instead
+METRICS_STREAM_PATHS = {"/api/events/stream"}
+
+class MetricsMiddleware:
+    # Pure ASGI so the scope it publishes is the one the router fills with "route"
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
+        token = request_scope.set(scope)
+        started = time.perf_counter()
+        status_code = 500
+        streaming = scope["path"] in METRICS_STREAM_PATHS
+        if streaming:
+            gauge, help_text, gauge_labels = "sanacare_http_streams_open", "Event streams currently open", (("path", scope["path"]),)
+        else:
+            gauge, help_text, gauge_labels = "sanacare_http_requests_in_flight", "Requests currently being served", (("method", scope["method"]),)
+        metrics.add(gauge, help_text, gauge_labels, 1)
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = current_route()
+            labels = (("method", scope["method"]), ("route", route))
+            metrics.add(gauge, help_text, gauge_labels, -1)
+            if not streaming:
+                metrics.observe("sanacare_http_request_duration_seconds", "Request latency by route", labels, time.perf_counter() - started)
+            metrics.inc("sanacare_http_requests_total", "Requests by route and status", labels + (("status", status_code),))
+            request_scope.reset(token)
+
+# Profiling
+# Opt-in sampling profiler. An admin sends "X-Profile: 1" (or PROFILE_SAMPLE_RATE
+# picks requests at random); while any profiled request is in flight a thread
+# samples the event loop every PROFILE_INTERVAL_MS. Samples taken while the
+# request's task is running record the thread stack, otherwise the chain of
+# awaits it is suspended on. Nothing runs when no request is being profiled.
+PROFILE_CATEGORIES = [
+    ("bcrypt", ("/passlib/", "/bcrypt/"), ("PasswordWorkerPool.",)),
+    ("jwt", ("/jwt/",), ()),
+    ("db", ("/motor/", "/pymongo/", "/mongomock"), ()),
+    ("validation", ("/pydantic/", "/fastapi/encoders", "/fastapi/_compat"), ("serialize_response", "request_body_to_args", "ModelEncoder.")),
+]
+
+def _frame_label(code) -> str:
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _thread_stack(frame) -> list:
+    codes = []
+    while frame is not None and len(codes) < 256:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    return codes[::-1]
+
+def _await_stack(coro) -> list:
+    codes = []
+    while coro is not None and len(codes) < 256:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        codes.append(frame.f_code)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return codes
+
+def _categorize(codes: list, default: str) -> str:
+    for code in reversed(codes):
+        for category, paths, names in PROFILE_CATEGORIES:
+            if any(p in code.co_filename for p in paths) or any(code.co_qualname.startswith(n) for n in names):
+                return category
+    return default
+
+class RequestProfile:
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.thread_id = threading.get_ident()
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.stacks = {}
+        self.categories = {}
+        self.samples = 0
+
+    def sample(self, frames: dict):
+        if asyncio.current_task(self.loop) is self.task:
+            kind, codes = "running", _thread_stack(frames.get(self.thread_id))
+            default = "cpu"
+        else:
+            kind, codes = "awaiting", _await_stack(self.task.get_coro())
+            default = "await"
+        folded = ";".join([f"[{kind}]"] + [_frame_label(code) for code in codes])
+        category = _categorize(codes, default)
+        self.stacks[folded] = self.stacks.get(folded, 0) + 1
+        self.categories[category] = self.categories.get(category, 0) + 1
+        self.samples += 1
+
+    def summary(self, route: str, status_code: int) -> dict:
+        duration = (time.perf_counter() - self.started) * 1000
         return {
-            "total_shifts": len(user_shifts),
-            "total_hours": total_hours,
-            "total_earned": total_earned,
-            "pending_amount": pending_amount,
-            "unread_messages": unread_messages
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "route": route,
+            "status": status_code,
+            "started_at": self.started_at,
+            "duration_ms": round(duration, 2),
+            "samples": self.samples,
+            # Samples are spread over the whole request, so scale them to its duration
+            "categories_ms": {
+                category: round(duration * count / self.samples, 2)
+                for category, count in sorted(self.categories.items(), key=lambda item: -item[1])
+            } if self.samples else {},
+            "stacks": self.stacks
         }
 
+class SamplingProfiler:
+    def __init__(self, interval: float, sample_rate: float, store_size: int):
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.store_size = store_size
+        self.lock = threading.Lock()
+        self.active = {}
+        self.profiles = OrderedDict()
+        self.thread = None
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, profile: RequestProfile):
+        with self.lock:
+            self.active[profile.request_id] = profile
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self.thread.start()
+
+    def finish(self, profile: RequestProfile, route: str, status_code: int):
+        with self.lock:
+            self.active.pop(profile.request_id, None)
+            self.profiles[profile.request_id] = profile.summary(route, status_code)
+            self.profiles.move_to_end(profile.request_id)
+            while len(self.profiles) > self.store_size:
+                self.profiles.popitem(last=False)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.active:
+                    self.thread = None
+                    return
+                active = list(self.active.values())
+            frames = sys._current_frames()
+            for profile in active:
+                try:
+                    profile.sample(frames)
+                except Exception:
+                    # The loop keeps running while we walk its stacks; skip a torn sample
+                    pass
+            del frames
+            time.sleep(self.interval)
+
+    def get(self, request_id: str) -> Optional[dict]:
+        with self.lock:
+            return self.profiles.get(request_id)
+
+    def recent(self) -> List[dict]:
+        with self.lock:
+            return [{k: v for k, v in p.items() if k != "stacks"} for p in reversed(self.profiles.values())]
+
+profiler = SamplingProfiler(
+    interval=float(os.environ.get('PROFILE_INTERVAL_MS', '1')) / 1000,
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+    store_size=int(os.environ.get('PROFILE_STORE_SIZE', '200'))
+)
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def _requested_by_admin(self, headers: dict) -> bool:
+        authorization = headers.get(b"authorization", b"").decode()
+        if not authorization.lower().startswith("bearer "):
+            return False
+        try:
+            user = await authenticate_token(authorization[7:])
+        except HTTPException:
+            return False
+        return user.role == "admin"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        requested = headers.get(b"x-profile") in (b"1", b"true") and await self._requested_by_admin(headers)
+        if not requested and not profiler.should_sample():
+            await self.app(scope, receive, send)
+            return
+        
+        request_id = headers.get(b"x-request-id", b"").decode()[:64] or uuid.uuid4().hex
+        profile = RequestProfile(request_id, scope["method"], scope["path"])
+        status_code = 500
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", request_id.encode())]
+            await send(message)
+        
+        profiler.start(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            profiler.finish(profile, route.path if route is not None else "unmatched", status_code)
+
+@api_router.get("/admin/profiles")
+async def list_profiles(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return {"sample_rate": profiler.sample_rate, "interval_ms": profiler.interval * 1000, "profiles": profiler.recent()}
+
+@api_router.patch("/admin/profiles")
+async def update_profiling(sample_rate: float = Query(..., ge=0, le=1), current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    profiler.sample_rate = sample_rate
+    return {"sample_rate": profiler.sample_rate, "interval_ms": profiler.interval * 1000}
+
+@api_router.get("/admin/profiles/{request_id}")
+async def get_profile(request_id: str, format: str = "json", current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    profile = profiler.get(request_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        # Collapsed stacks, as read by flamegraph.pl, speedscope and inferno
+        lines = [f"{stack} {count}" for stack, count in profile["stacks"].items()]
+        return Response(content="\n".join(lines) + "\n", media_type="text/plain")
+    return profile
+
 # Include router
 app.include_router(api_router)
 
@@ -580,14 +3723,90 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+notification_archiver = None
+payslip_pdf_pruner = None
+
+@app.on_event("startup")
+async def startup_notification_outbox():
+    notification_outbox.start()
+
+@app.on_event("startup")
+async def startup_db():
+    report = await ensure_indexes()
+    for collection, names in report["created"].items():
+        logger.info(f"Created indexes on {collection}: {', '.join(names)}")
+    for collection, names in report["dropped"].items():
+        logger.info(f"Dropped indexes on {collection}: {', '.join(names)}")
+    for collection, failures in report["failed"].items():
+        for failure in failures:
+            logger.error(f"Could not create index {failure['name']} on {collection}: {failure['error']}")
+    for collection, issues in report["drift"].items():
+        for issue in issues:
+            logger.warning(f"Index drift on {collection}: {issue['name']} {issue['issue']}")
+    
+    if os.environ.get('DATE_MIGRATION_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes'):
+        report = await migrate_dates()
+        for collection, progress in report.items():
+            if progress["failed"]:
+                logger.warning(f"Date migration could not convert {progress['failed']} documents in {collection}")
+    
+    if os.environ.get('INDEX_EXPLAIN_AUDIT', '').lower() in ('1', 'true', 'yes'):
+        for finding in await explain_audit():
+            logger.warning(f"{finding['stage']} on {finding['collection']} for {finding['filter']} sort={finding['sort']}")
+    
+    moved = await migrate_inline_photos()
+    if moved:
+        logger.info(f"Moved {moved} inline profile photos to {PHOTO_DIR}")
+    
+    # Only when missing: write routes keep existing counters current, and a rebuild
+    # racing them (or another worker starting up) would drop their increments
+    if DASHBOARD_COUNTERS and not await db.dashboard_counters.find_one({"id": "global"}, {"_id": 0, "id": 1}):
+        await rebuild_dashboard_counters()
+    
+    # Backfill conversation summaries the first time this runs on existing data
+    if await db.conversations.estimated_document_count() == 0 and await db.messages.estimated_document_count() > 0:
+        await rebuild_conversations()
+    
+    # Same for unread counters; notifications read before read_at existed start their retention now
+    if await db.notification_counters.estimated_document_count() == 0 and await db.notifications.estimated_document_count() > 0:
+        await db.notifications.update_many(
+            {"read": True, "read_at": {"$exists": False}},
+            {"$set": {"read_at": datetime.now(timezone.utc)}}
+        )
+        await rebuild_notification_counters()
+    
+    interrupted = await mark_interrupted_runs()
+    if interrupted:
+        logger.warning(f"Marked {interrupted} unfinished payroll runs as interrupted")
+    
+    global notification_archiver
+    if NOTIFICATION_ARCHIVE and NOTIFICATION_RETENTION_DAYS > 0:
+        interval = float(os.environ.get('NOTIFICATION_ARCHIVE_INTERVAL', '3600'))
+        notification_archiver = asyncio.create_task(run_notification_archiver(interval))
+    
+    global payslip_pdf_pruner
+    payslip_pdf_pruner = asyncio.create_task(run_payslip_pdf_pruner(float(os.environ.get('PAYSLIP_PDF_PRUNE_INTERVAL', '3600'))))
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if notification_archiver is not None:
+        notification_archiver.cancel()
+    if payslip_pdf_pruner is not None:
+        payslip_pdf_pruner.cancel()
+    for task in payroll_tasks:
+        task.cancel()
+    await asyncio.gather(*payroll_tasks, return_exceptions=True)
+    await notification_outbox.drain(float(os.environ.get('NOTIFICATION_DRAIN_TIMEOUT', '30')))
     client.close()
+    password_pool.executor.shutdown(wait=False)
+    render_pool.executor.shutdown(wait=False)
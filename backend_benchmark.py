@@ -0,0 +1,465 @@
+import requests
+import os
+import sys
+import time
+import json
+import uuid
+import random
+import asyncio
+import argparse
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+class SanaCareBenchmark:
+    def __init__(self, base_url="http://localhost:8001"):
+        self.base_url = base_url
+        self.api_url = f"{base_url}/api"
+        self.admin_token = None
+        self.admin_email = None
+        self.password = "BenchPass123!"
+
+    def setup(self):
+        """Register and log in an admin used by the scenarios"""
+        timestamp = datetime.now().strftime('%H%M%S%f')
+        self.admin_email = f"bench_admin_{timestamp}@test.com"
+        requests.post(f"{self.api_url}/auth/register", json={
+            "email": self.admin_email,
+            "password": self.password,
+            "first_name": "Bench",
+            "last_name": "Admin",
+            "role": "admin"
+        }, timeout=30)
+        response = requests.post(f"{self.api_url}/auth/login", json={
+            "email": self.admin_email,
+            "password": self.password
+        }, timeout=30)
+        response.raise_for_status()
+        self.admin_token = response.json()["access_token"]
+
+    def login_storm(self, duration=10.0, storm_clients=32, probe_interval=0.05):
+        """Measure latency of an unrelated endpoint while many clients log in"""
+        print(f"\n🔍 Login storm: {storm_clients} clients for {duration:.0f}s")
+        stop = threading.Event()
+        logins = {"ok": 0, "busy": 0, "error": 0}
+        lock = threading.Lock()
+
+        def storm():
+            session = requests.Session()
+            while not stop.is_set():
+                try:
+                    response = session.post(f"{self.api_url}/auth/login", json={
+                        "email": self.admin_email,
+                        "password": self.password
+                    }, timeout=30)
+                    key = "ok" if response.status_code == 200 else "busy" if response.status_code == 503 else "error"
+                except requests.exceptions.RequestException:
+                    key = "error"
+                with lock:
+                    logins[key] += 1
+
+        def probe():
+            session = requests.Session()
+            headers = {"Authorization": f"Bearer {self.admin_token}"}
+            samples = []
+            while not stop.is_set():
+                start = time.perf_counter()
+                session.get(f"{self.api_url}/institutions", headers=headers, timeout=30)
+                samples.append((time.perf_counter() - start) * 1000)
+                time.sleep(probe_interval)
+            return samples
+
+        with ThreadPoolExecutor(max_workers=storm_clients + 1) as pool:
+            probe_future = pool.submit(probe)
+            for _ in range(storm_clients):
+                pool.submit(storm)
+            time.sleep(duration)
+            stop.set()
+            samples = probe_future.result()
+
+        print(f"Logins: {logins['ok']} ok, {logins['busy']} rejected (503), {logins['error']} errors")
+        print(f"GET /api/institutions during storm ({len(samples)} samples): "
+              f"p50={percentile(samples, 50):.1f}ms p95={percentile(samples, 95):.1f}ms p99={percentile(samples, 99):.1f}ms")
+        return samples
+
+    def availability_search(self, slots=100000, queries=200, institutions=50):
+        """Seed schedule slots straight into Mongo and time /api/availability"""
+        from pymongo import MongoClient
+        print(f"\n🔍 Availability search over {slots} slots")
+        database = MongoClient(os.environ['MONGO_URL'], tz_aware=True)[os.environ['DB_NAME']]
+        institution_ids = [f"bench-institution-{i}" for i in range(institutions)]
+        base = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        docs = []
+        for _ in range(slots):
+            starts_at = base + timedelta(days=random.randrange(90), hours=random.randrange(6, 14))
+            docs.append({
+                "id": str(uuid.uuid4()),
+                "user_id": f"bench-user-{random.randrange(5000)}",
+                "institution_id": random.choice(institution_ids),
+                "date": starts_at.replace(hour=0),
+                "start_time": starts_at.strftime("%H:%M"),
+                "end_time": (starts_at + timedelta(hours=8)).strftime("%H:%M"),
+                "starts_at": starts_at,
+                "ends_at": starts_at + timedelta(hours=8),
+                "status": random.choice(["available", "available", "available", "booked"]),
+                "created_at": datetime.now(timezone.utc)
+            })
+        database.schedules.delete_many({"institution_id": {"$in": institution_ids}})
+        database.schedules.insert_many(docs)
+
+        session = requests.Session()
+        headers = {"Authorization": f"Bearer {self.admin_token}"}
+        samples = []
+        try:
+            for _ in range(queries):
+                start = base + timedelta(days=random.randrange(90), hours=random.randrange(8, 16))
+                params = {
+                    "institution_id": random.choice(institution_ids),
+                    "start": start.isoformat(),
+                    "end": (start + timedelta(hours=2)).isoformat()
+                }
+                began = time.perf_counter()
+                session.get(f"{self.api_url}/availability", params=params, headers=headers, timeout=30).raise_for_status()
+                samples.append((time.perf_counter() - began) * 1000)
+        finally:
+            database.schedules.delete_many({"institution_id": {"$in": institution_ids}})
+
+        print(f"GET /api/availability ({len(samples)} queries): "
+              f"p50={percentile(samples, 50):.1f}ms p95={percentile(samples, 95):.1f}ms p99={percentile(samples, 99):.1f}ms")
+        return samples
+
+def import_server(db_name="sanacare_benchmark"):
+    """Import backend/server.py without a .env pointing it at a real database"""
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ.setdefault('DB_NAME', db_name)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import server
+    return server
+
+def serialization(sizes=(1000, 10000), repeat=5):
+    """Compare the list response encoder with per-row models plus FastAPI's response validation"""
+    server = import_server()
+    from pydantic import TypeAdapter
+    from typing import List
+
+    now = datetime.now(timezone.utc)
+    fixtures = {
+        "get_shifts": (server.Shift, lambda i: {
+            "id": str(uuid.uuid4()), "user_id": str(uuid.uuid4()), "institution_id": str(uuid.uuid4()),
+            "date": now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=i % 60),
+            "hours": 7.5, "hourly_rate": 28.0, "travel_cost": 4.5, "total": 214.5,
+            "status": random.choice(["pending", "validated", "paid"]), "created_at": now
+        }),
+        "get_users": (server.User, lambda i: {
+            "id": str(uuid.uuid4()), "email": f"user{i}@example.com", "first_name": "Marie", "last_name": "Dupont",
+            "role": "infirmier", "phone": "0600000000", "photo": None, "photo_thumb": None,
+            "institution_id": None, "referent_id": None, "status": "approved", "created_at": now
+        })
+    }
+
+    print("\n🔍 List response serialization")
+    for route, (model, make) in fixtures.items():
+        adapter = TypeAdapter(List[model])
+        encoder = server.encoder_for(model)
+        for size in sizes:
+            docs = [make(i) for i in range(size)]
+
+            def previous():
+                # [Model(**d) for d in docs], then FastAPI re-validates against response_model and JSON-encodes
+                content = [model(**d).model_dump() for d in docs]
+                return json.dumps(adapter.dump_python(adapter.validate_python(content), mode="json")).encode()
+
+            timings = {}
+            for name, fn in (("models + response_model", previous), ("list_response", lambda: encoder.dumps(docs))):
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    fn()
+                    samples.append((time.perf_counter() - start) * 1000)
+                timings[name] = percentile(samples, 50)
+            before, after = timings["models + response_model"], timings["list_response"]
+            print(f"{route} {size} rows: {before:.1f}ms -> {after:.1f}ms ({before / after:.1f}x)")
+
+class RouteStats:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.elapsed = defaultdict(float)
+
+    def record(self, route, ms, ok=True):
+        self.samples[route].append(ms)
+        if not ok:
+            self.errors[route] += 1
+
+    def report(self):
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            elapsed = self.elapsed.get(route) or sum(samples) / 1000
+            routes[route] = {
+                "count": len(samples),
+                "errors": self.errors[route],
+                "p50": round(percentile(samples, 50), 2),
+                "p95": round(percentile(samples, 95), 2),
+                "p99": round(percentile(samples, 99), 2),
+                "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0
+            }
+        return routes
+
+class OfflineBenchmark:
+    """Drives backend/server.py in-process (or under uvicorn) against an in-memory Motor stand-in or a local mongod"""
+    def __init__(self, mongo_url=None, db_name="sanacare_benchmark", scale=1.0, use_uvicorn=False, port=8765):
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self.scale = scale
+        self.use_uvicorn = use_uvicorn
+        self.port = port
+        self.password = "BenchPass123!"
+        self.stats = RouteStats()
+        self.server = None
+        self.http = None
+        self.admin = None
+        self.users = []
+        self.tokens = {}
+        self.period = None
+
+    def _connect(self):
+        # Checked before seeding so a missing dev dependency fails fast
+        try:
+            import httpx
+        except ImportError:
+            raise SystemExit("The offline suite needs httpx: pip install -r backend/requirements-dev.txt")
+        if self.mongo_url:
+            os.environ['MONGO_URL'] = self.mongo_url
+        os.environ['DB_NAME'] = self.db_name
+        self.server = import_server(self.db_name)
+        if not self.mongo_url:
+            try:
+                from mongomock_motor import AsyncMongoMockClient
+            except ImportError:
+                raise SystemExit("Install backend/requirements-dev.txt or pass --mongo-url for a local mongod")
+            self.server.db = AsyncMongoMockClient()[self.db_name]
+
+    async def seed(self, users=200, institutions=20, shifts=20000, messages=10000):
+        """Insert realistic volumes directly, sharing one bcrypt hash across seeded users"""
+        db = self.server.db
+        for name in await db.list_collection_names():
+            await db.drop_collection(name)
+        users, shifts, messages = int(users * self.scale), int(shifts * self.scale), int(messages * self.scale)
+        print(f"\n🌱 Seeding {users} users, {institutions} institutions, {shifts} shifts, {messages} messages")
+        now = datetime.now(timezone.utc)
+        password_hash = self.server.hash_password(self.password)
+
+        def user(i, role):
+            return {
+                "id": str(uuid.uuid4()), "email": f"bench{i}@test.com", "first_name": "Bench", "last_name": str(i),
+                "role": role, "phone": None, "photo": None, "photo_thumb": None, "institution_id": None,
+                "referent_id": None, "status": "approved", "password_hash": password_hash,
+                "created_at": now - timedelta(minutes=i)
+            }
+
+        self.admin = user(0, "admin")
+        self.users = [user(i, random.choice(["infirmier", "aide_soignant"])) for i in range(1, users + 1)]
+        institution_docs = [{
+            "id": str(uuid.uuid4()), "name": f"Institution {i}", "address": "1 rue de la Paix", "phone": "0100000000",
+            "email": f"institution{i}@test.com", "created_at": now
+        } for i in range(institutions)]
+
+        # Last month's shifts are validated so the payroll scenario has work to do
+        last_month = (now.replace(day=1) - timedelta(days=1)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        self.period = last_month.strftime("%Y-%m")
+        shift_docs = []
+        for i in range(shifts):
+            date = last_month + timedelta(days=random.randrange(90) - 30)
+            hours, rate, travel = random.choice([4.0, 7.5, 10.0]), random.choice([24.0, 28.0, 32.0]), random.choice([0.0, 4.5, 9.0])
+            shift_docs.append({
+                "id": str(uuid.uuid4()), "user_id": random.choice(self.users)["id"],
+                "institution_id": random.choice(institution_docs)["id"], "date": date,
+                "hours": hours, "hourly_rate": rate, "travel_cost": travel, "total": self.server.shift_total(hours, rate, travel),
+                "status": "validated" if date.strftime("%Y-%m") == self.period else random.choice(["pending", "validated", "paid"]),
+                "created_at": date
+            })
+        message_docs = []
+        for i in range(messages):
+            sender, recipient = random.sample(self.users, 2)
+            message_docs.append({
+                "id": str(uuid.uuid4()), "sender_id": sender["id"], "recipient_id": recipient["id"],
+                "content": "Bonjour, pouvez-vous me remplacer demain ?", "timestamp": now - timedelta(seconds=messages - i),
+                "read": random.random() < 0.8
+            })
+
+        for collection, docs in (("users", [self.admin] + self.users), ("institutions", institution_docs),
+                                 ("shifts", shift_docs), ("messages", message_docs)):
+            for i in range(0, len(docs), 1000):
+                await db[collection].insert_many(docs[i:i + 1000])
+        self.tokens = {u["id"]: self.server.issue_tokens(u)["access_token"] for u in [self.admin] + self.users}
+
+    async def _start(self):
+        import httpx
+        app = self.server.app
+        if self.use_uvicorn:
+            import uvicorn
+            self._uvicorn = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+            self._uvicorn_task = asyncio.create_task(self._uvicorn.serve())
+            while not self._uvicorn.started:
+                await asyncio.sleep(0.05)
+            self.http = httpx.AsyncClient(base_url=f"http://127.0.0.1:{self.port}", timeout=60)
+        else:
+            await app.router.startup()
+            self.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=60)
+
+    async def _stop(self):
+        await self.http.aclose()
+        if self.use_uvicorn:
+            self._uvicorn.should_exit = True
+            await self._uvicorn_task
+        else:
+            await self.server.app.router.shutdown()
+
+    async def request(self, route, method, path, user=None, **kwargs):
+        headers = kwargs.pop("headers", {})
+        if user is not None:
+            headers["Authorization"] = f"Bearer {self.tokens[user['id']]}"
+        start = time.perf_counter()
+        response = await self.http.request(method, path, headers=headers, **kwargs)
+        self.stats.record(route, (time.perf_counter() - start) * 1000, response.status_code < 400)
+        return response
+
+    async def _scenario(self, name, workers, worker):
+        print(f"\n🔍 {name}: {workers} concurrent clients")
+        before = {route: len(samples) for route, samples in self.stats.samples.items()}
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(workers)))
+        elapsed = time.perf_counter() - start
+        for route, samples in self.stats.samples.items():
+            if len(samples) != before.get(route, 0):
+                self.stats.elapsed[route] += elapsed
+        print(f"Finished in {elapsed:.1f}s")
+
+    async def login_storm(self, workers=16, logins=4):
+        async def worker(i):
+            for _ in range(logins):
+                await self.request("POST /api/auth/login", "POST", "/api/auth/login", json={
+                    "email": random.choice(self.users)["email"], "password": self.password
+                })
+        await self._scenario("Login storm", workers, worker)
+
+    async def dashboard(self, workers=32, rounds=10):
+        async def worker(i):
+            user = self.admin if i % 4 == 0 else random.choice(self.users)
+            for _ in range(rounds):
+                await self.request("GET /api/dashboard/stats", "GET", "/api/dashboard/stats", user)
+        await self._scenario("Dashboard", workers, worker)
+
+    async def message_polling(self, workers=64, rounds=10):
+        """Clients poll like the frontend does, revalidating with ETags, and occasionally send"""
+        async def worker(i):
+            user = self.users[i % len(self.users)]
+            etags = {}
+            for round_ in range(rounds):
+                for route, path in (("GET /api/conversations", "/api/conversations"),
+                                    ("GET /api/messages", "/api/messages?limit=50"),
+                                    ("GET /api/notifications", "/api/notifications")):
+                    headers = {"If-None-Match": etags[path]} if path in etags else {}
+                    response = await self.request(route, "GET", path, user, headers=headers)
+                    if "etag" in response.headers:
+                        etags[path] = response.headers["etag"]
+                if round_ % 5 == 4:
+                    await self.request("POST /api/messages", "POST", "/api/messages", user, json={
+                        "recipient_id": random.choice(self.users)["id"], "content": "Message de charge"
+                    })
+        await self._scenario("Message polling", workers, worker)
+
+    async def payroll_run(self):
+        async def worker(i):
+            start = time.perf_counter()
+            response = await self.request("POST /api/payslips/run", "POST", f"/api/payslips/run?period={self.period}", self.admin)
+            run = response.json()
+            while run.get("status") == "running":
+                await asyncio.sleep(0.05)
+                run = (await self.request("GET /api/payslips/runs/{run_id}", "GET", f"/api/payslips/runs/{run['id']}", self.admin)).json()
+            self.stats.record("payroll run (end to end)", (time.perf_counter() - start) * 1000, run.get("status") == "completed")
+            print(f"Payroll {self.period}: {run.get('payslips_created')} payslips, {run.get('payslips_per_second', 0):.0f}/s")
+        await self._scenario("Payroll run", 1, worker)
+
+    async def run(self):
+        self._connect()
+        await self.seed()
+        await self._start()
+        try:
+            await self.login_storm()
+            await self.dashboard()
+            await self.message_polling()
+            await self.payroll_run()
+        finally:
+            await self._stop()
+            if self.mongo_url:
+                await self.server.client.drop_database(self.db_name)
+        return self.stats.report()
+
+def print_report(routes):
+    print(f"\n{'route':<40}{'count':>8}{'errors':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'req/s':>10}")
+    for route, row in routes.items():
+        print(f"{route:<40}{row['count']:>8}{row['errors']:>8}{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}{row['rps']:>10.1f}")
+
+def compare_baseline(routes, baseline, tolerance):
+    """Routes whose p95 grew more than tolerance over the stored baseline"""
+    regressions = []
+    for route, row in routes.items():
+        previous = baseline.get(route)
+        if previous and row["p95"] > previous["p95"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {row['p95']:.1f}ms vs baseline {previous['p95']:.1f}ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="SanaCare backend benchmarks")
+    parser.add_argument("target", nargs="?", default="http://localhost:8001",
+                        help="base URL of a running server, 'offline' for the in-process suite or 'serialization'")
+    parser.add_argument("--mongo-url", help="offline: use this local mongod instead of the in-memory stand-in")
+    parser.add_argument("--uvicorn", action="store_true", help="offline: serve the app with uvicorn instead of in-process ASGI")
+    parser.add_argument("--scale", type=float, default=1.0, help="offline: multiply seeded volumes")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 growth over the baseline")
+    args = parser.parse_args()
+
+    if args.target == "serialization":
+        serialization()
+        return 0
+    if args.target == "offline":
+        routes = asyncio.run(OfflineBenchmark(args.mongo_url, scale=args.scale, use_uvicorn=args.uvicorn).run())
+        print_report(routes)
+        if args.save_baseline:
+            with open(args.baseline, "w") as f:
+                json.dump(routes, f, indent=2)
+            print(f"\nBaseline saved to {args.baseline}")
+            return 0
+        failed = [f"{route}: {row['errors']} errors" for route, row in routes.items() if row["errors"]]
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                failed += compare_baseline(routes, json.load(f), args.tolerance)
+        for failure in failed:
+            print(f"❌ {failure}")
+        return 1 if failed else 0
+
+    base_url = args.target
+    benchmark = SanaCareBenchmark(base_url)
+    benchmark.setup()
+    benchmark.login_storm()
+    if 'MONGO_URL' in os.environ and 'DB_NAME' in os.environ:
+        benchmark.availability_search()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
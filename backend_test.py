@@ -297,6 +297,175 @@ class SanaCareAPITester:
         else:
             self.log_test("Get Exchanges", False, f"Status: {status}, Response: {response}")
 
+    def test_bulk_shifts(self):
+        """Test bulk shift creation"""
+        print("\n🔍 Testing Bulk Shift Creation...")
+        
+        if not self.institution_id or not self.test_user_id:
+            self.log_test("Bulk Shift Creation", False, "Missing institution_id or user_id")
+            return
+        
+        # One valid item and one missing its hours
+        shifts_data = [
+            {
+                "user_id": self.test_user_id,
+                "institution_id": self.institution_id,
+                "date": "2025-01-16",
+                "hours": 8.0,
+                "hourly_rate": 25.0,
+                "travel_cost": 10.0
+            },
+            {
+                "user_id": self.test_user_id,
+                "institution_id": self.institution_id,
+                "date": "2025-01-17"
+            }
+        ]
+        
+        success, response, status = self.make_request('POST', 'shifts/bulk', shifts_data, expected_status=200)
+        results = response.get('results', []) if success else []
+        if (success and response.get('total') == 2 and response.get('summary') == {"created": 1, "error": 1}
+                and [r.get('status') for r in results] == ["created", "error"] and results[0].get('id')):
+            self.log_test("Bulk Shift Creation", True)
+        else:
+            self.log_test("Bulk Shift Creation", False, f"Status: {status}, Response: {response}")
+
+    def test_bulk_shift_status(self):
+        """Test bulk shift status update"""
+        print("\n🔍 Testing Bulk Shift Status...")
+        
+        if not self.admin_token or not self.shift_id:
+            self.log_test("Bulk Shift Status", False, "Missing admin_token or shift_id")
+            return
+        
+        status_data = {
+            "shift_ids": [self.shift_id, "missing-shift-id"],
+            "status": "validated"
+        }
+        
+        success, response, status = self.make_request('PATCH', 'shifts/bulk-status', status_data,
+                                                    token=self.admin_token, expected_status=200)
+        results = response.get('results', []) if success else []
+        if (success and response.get('total') == 2 and response.get('summary') == {"updated": 1, "not_found": 1}
+                and [(r.get('id'), r.get('status')) for r in results] == [(self.shift_id, "updated"), ("missing-shift-id", "not_found")]):
+            self.log_test("Bulk Shift Status", True)
+        else:
+            self.log_test("Bulk Shift Status", False, f"Status: {status}, Response: {response}")
+
+    def test_user_import(self):
+        """Test user import"""
+        print("\n🔍 Testing User Import...")
+        
+        if not self.admin_token:
+            self.log_test("User Import", False, "Missing admin_token")
+            return
+        
+        # One new account and one reusing an existing email
+        timestamp = datetime.now().strftime('%H%M%S')
+        users_data = [
+            {
+                "email": f"imported_nurse_{timestamp}@test.com",
+                "password": "TestPass123!",
+                "first_name": "Claire",
+                "last_name": "Import",
+                "role": "infirmier"
+            },
+            {
+                "email": self.test_user_email,
+                "password": "TestPass123!",
+                "first_name": "Marie",
+                "last_name": "Doublon",
+                "role": "infirmier"
+            }
+        ]
+        
+        success, response, status = self.make_request('POST', 'users/import', users_data,
+                                                    token=self.admin_token, expected_status=200)
+        results = response.get('results', []) if success else []
+        if (success and response.get('total') == 2 and response.get('summary') == {"created": 1, "error": 1}
+                and [r.get('status') for r in results] == ["created", "error"] and results[0].get('id')):
+            self.log_test("User Import", True)
+        else:
+            self.log_test("User Import", False, f"Status: {status}, Response: {response}")
+
+    def test_schedule_templates(self):
+        """Test recurring schedule templates"""
+        print("\n🔍 Testing Schedule Templates...")
+        
+        if not self.institution_id or not self.test_user_id:
+            self.log_test("Schedule Template Creation", False, "Missing institution_id or user_id")
+            return
+        
+        template_data = {
+            "user_id": self.test_user_id,
+            "institution_id": self.institution_id,
+            "weekdays": [0, 2, 4],
+            "slots": [{"start_time": "08:00", "end_time": "16:00"}],
+            "starts_on": datetime.now().strftime('%Y-%m-%d')
+        }
+        
+        success, response, status = self.make_request('POST', 'schedule-templates', template_data, expected_status=200)
+        if success and response.get('id') and response.get('expanded_until'):
+            self.log_test("Schedule Template Creation", True)
+        else:
+            self.log_test("Schedule Template Creation", False, f"Status: {status}, Response: {response}")
+        
+        # Test getting templates
+        success, response, status = self.make_request('GET', 'schedule-templates', expected_status=200)
+        if success and isinstance(response, list):
+            self.log_test("Get Schedule Templates", True)
+        else:
+            self.log_test("Get Schedule Templates", False, f"Status: {status}, Response: {response}")
+
+    def test_sync(self):
+        """Test incremental sync"""
+        print("\n🔍 Testing Sync...")
+        
+        success, response, status = self.make_request('GET', 'sync', expected_status=200)
+        if success and isinstance(response.get('cursor'), int):
+            self.log_test("Sync Cursor", True)
+        else:
+            self.log_test("Sync Cursor", False, f"Status: {status}, Response: {response}")
+            return
+        
+        # Test pulling changes since the cursor
+        cursor = response['cursor']
+        success, response, status = self.make_request('GET', f'sync?since={cursor}', expected_status=200)
+        if (success and isinstance(response.get('changes'), list) and isinstance(response.get('cursor'), int)
+                and isinstance(response.get('has_more'), bool)):
+            self.log_test("Sync Changes", True)
+        else:
+            self.log_test("Sync Changes", False, f"Status: {status}, Response: {response}")
+
+    def test_payroll_run(self):
+        """Test payroll run"""
+        print("\n🔍 Testing Payroll Run...")
+        
+        if not self.admin_token:
+            self.log_test("Payroll Run", False, "Missing admin_token")
+            return
+        
+        period = datetime.now().strftime('%Y-%m')
+        success, response, status = self.make_request('POST', f'payslips/run?period={period}', None,
+                                                    token=self.admin_token, expected_status=200)
+        if success and response.get('id') and response.get('status') == "running":
+            self.log_test("Payroll Run", True)
+        elif status == 409:
+            # Another run for this period is still in progress
+            self.log_test("Payroll Run", True)
+            return
+        else:
+            self.log_test("Payroll Run", False, f"Status: {status}, Response: {response}")
+            return
+        
+        # Test getting the run's progress
+        success, response, status = self.make_request('GET', f"payslips/runs/{response['id']}",
+                                                    token=self.admin_token, expected_status=200)
+        if success and response.get('period') == period and 'processed_users' in response:
+            self.log_test("Get Payroll Run", True)
+        else:
+            self.log_test("Get Payroll Run", False, f"Status: {status}, Response: {response}")
+
     def run_all_tests(self):
         """Run all API tests"""
         print("🚀 Starting Sana-Care API Tests...")
@@ -313,6 +482,12 @@ class SanaCareAPITester:
         self.test_notifications()
         self.test_payslips()
         self.test_exchanges()
+        self.test_bulk_shifts()
+        self.test_bulk_shift_status()
+        self.test_user_import()
+        self.test_schedule_templates()
+        self.test_sync()
+        self.test_payroll_run()
         
         # Print summary
         print(f"\n📊 Test Summary:")
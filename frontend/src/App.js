@@ -3,6 +3,7 @@ import { BrowserRouter, Routes, Route, Navigate } from 'react-router-dom';
 import axios from 'axios';
 import '@/App.css';
 import { Toaster, toast } from 'sonner';
+import { storeTokens, clearTokens, refreshAccessToken } from '@/lib/auth';
 
 // Pages
 import LoginPage from './pages/LoginPage';
@@ -35,10 +36,21 @@ axios.interceptors.request.use((config) => {
 
 axios.interceptors.response.use(
   (response) => response,
-  (error) => {
+  async (error) => {
+    const original = error.config;
+    // An expired access token is refreshed once, then the request is replayed
+    if (error.response?.status === 401 && original && !original._retry && !/\/auth\/(login|refresh)$/.test(original.url)) {
+      original._retry = true;
+      try {
+        const token = await refreshAccessToken();
+        original.headers.Authorization = `Bearer ${token}`;
+        return axios(original);
+      } catch (refreshError) {
+        // Fall through to logging out
+      }
+    }
     if (error.response?.status === 401) {
-      localStorage.removeItem('token');
-      localStorage.removeItem('user');
+      clearTokens();
       window.location.href = '/login';
     }
     return Promise.reject(error);
@@ -62,8 +74,7 @@ function App() {
           localStorage.setItem('user', JSON.stringify(res.data));
         })
         .catch(() => {
-          localStorage.removeItem('token');
-          localStorage.removeItem('user');
+          clearTokens();
           setUser(null);
         })
         .finally(() => setLoading(false));
@@ -72,15 +83,14 @@ function App() {
     }
   }, []);
 
-  const login = (token, userData) => {
-    localStorage.setItem('token', token);
+  const login = (tokens, userData) => {
+    storeTokens(tokens);
     localStorage.setItem('user', JSON.stringify(userData));
     setUser(userData);
   };
 
   const logout = () => {
-    localStorage.removeItem('token');
-    localStorage.removeItem('user');
+    clearTokens();
     setUser(null);
     toast.success('Déconnexion réussie');
   };
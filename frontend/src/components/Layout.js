@@ -3,6 +3,7 @@ import { Outlet, Link, useLocation } from 'react-router-dom';
 import { Bell, Menu, X, LayoutDashboard, Users, Building2, Calendar, Clock, FileText, MessageSquare, ArrowLeftRight, User, LogOut } from 'lucide-react';
 import axios from 'axios';
 import { toast } from 'sonner';
+import { subscribeEvents } from '@/lib/events';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -14,15 +15,20 @@ const Layout = ({ user, onLogout }) => {
 
   useEffect(() => {
     fetchNotificationCount();
-    const interval = setInterval(fetchNotificationCount, 30000);
-    return () => clearInterval(interval);
+  }, [location.pathname]);
+
+  useEffect(() => {
+    return subscribeEvents((type) => {
+      if (type === 'notification' || type === 'resync') {
+        fetchNotificationCount();
+      }
+    });
   }, []);
 
   const fetchNotificationCount = async () => {
     try {
-      const res = await axios.get(`${API}/notifications`);
-      const unread = res.data.filter(n => !n.read).length;
-      setNotificationCount(unread);
+      const res = await axios.get(`${API}/notifications/unread-count`);
+      setNotificationCount(res.data.unread);
     } catch (error) {
       console.error('Error fetching notifications:', error);
     }
@@ -0,0 +1,39 @@
+import axios from 'axios';
+import { resetSync } from '@/lib/sync';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+// Access tokens are short-lived; requests that hit a 401 at the same time share one refresh.
+let pending = null;
+
+export const storeTokens = (data) => {
+  localStorage.setItem('token', data.access_token);
+  if (data.refresh_token) {
+    localStorage.setItem('refresh_token', data.refresh_token);
+  }
+};
+
+export const clearTokens = () => {
+  localStorage.removeItem('token');
+  localStorage.removeItem('refresh_token');
+  localStorage.removeItem('user');
+  resetSync();
+};
+
+export const refreshAccessToken = () => {
+  if (!pending) {
+    const refreshToken = localStorage.getItem('refresh_token');
+    pending = (refreshToken
+      ? axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken })
+      : Promise.reject(new Error('No refresh token')))
+      .then((res) => {
+        storeTokens(res.data);
+        return res.data.access_token;
+      })
+      .finally(() => {
+        pending = null;
+      });
+  }
+  return pending;
+};
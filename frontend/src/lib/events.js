@@ -0,0 +1,59 @@
+import { refreshAccessToken } from '@/lib/auth';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+// One shared EventSource per tab; the browser resumes from Last-Event-ID on reconnect.
+const listeners = new Set();
+let source = null;
+let lastEventId = null;
+
+const dispatch = (type) => (event) => {
+  if (event.lastEventId) lastEventId = event.lastEventId;
+  const data = event.data ? JSON.parse(event.data) : {};
+  listeners.forEach((listener) => listener(type, data));
+};
+
+const open = () => {
+  const token = localStorage.getItem('token');
+  if (!token || source) return;
+  const cursor = lastEventId ? `&cursor=${encodeURIComponent(lastEventId)}` : '';
+  source = new EventSource(`${API}/events/stream?token=${encodeURIComponent(token)}${cursor}`);
+  ['message', 'notification', 'resync'].forEach((type) => {
+    source.addEventListener(type, dispatch(type));
+  });
+  // The server ends an open stream once its token expires or is revoked
+  source.addEventListener('reauth', () => {
+    close();
+    reopen();
+  });
+  // The browser retries dropped connections by itself, but a rejected (expired) token closes the stream
+  source.onerror = () => {
+    if (source && source.readyState === EventSource.CLOSED) {
+      source = null;
+      reopen();
+    }
+  };
+};
+
+const reopen = () => {
+  refreshAccessToken().then(() => {
+    if (listeners.size > 0) open();
+  }).catch(() => {});
+};
+
+const close = () => {
+  if (source) {
+    source.close();
+    source = null;
+  }
+};
+
+export const subscribeEvents = (listener) => {
+  listeners.add(listener);
+  open();
+  return () => {
+    listeners.delete(listener);
+    if (listeners.size === 0) close();
+  };
+};
@@ -0,0 +1,63 @@
+import axios from 'axios';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+// Lists are loaded in full once per tab and then kept current from /api/sync,
+// which returns only what changed since the last cursor.
+let lists = {};
+let cursor = null;
+let pending = null;
+
+export const resetSync = () => {
+  lists = {};
+  cursor = null;
+};
+
+const apply = (changes) => {
+  changes.forEach((change) => {
+    const list = lists[change.type];
+    if (!list) return;
+    if (change.op === 'delete') {
+      list.delete(change.id);
+    } else {
+      list.set(change.id, change.data);
+    }
+  });
+};
+
+const pull = async () => {
+  // The cursor is taken before any list is loaded, so nothing written in between is missed
+  if (cursor === null) {
+    const res = await axios.get(`${API}/sync`);
+    cursor = res.data.cursor;
+    return;
+  }
+  try {
+    let more = true;
+    while (more) {
+      const res = await axios.get(`${API}/sync`, { params: { since: cursor } });
+      apply(res.data.changes);
+      cursor = res.data.cursor;
+      more = res.data.has_more;
+    }
+  } catch (error) {
+    if (error.response?.status !== 410) throw error;
+    resetSync();
+    await pull();
+  }
+};
+
+export const syncedList = async (type, path) => {
+  if (!pending) {
+    pending = pull().finally(() => {
+      pending = null;
+    });
+  }
+  await pending;
+  if (!lists[type]) {
+    const res = await axios.get(`${API}${path}`);
+    lists[type] = new Map(res.data.map((item) => [item.id, item]));
+  }
+  return Array.from(lists[type].values());
+};
@@ -4,3 +4,11 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// Stored photos are served by the backend at /api/photos/...
+export function photoUrl(photo) {
+  if (photo && photo.startsWith('/api/')) {
+    return `${process.env.REACT_APP_BACKEND_URL}${photo}`;
+  }
+  return photo;
+}
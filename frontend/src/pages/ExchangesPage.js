@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
+import { syncedList } from '@/lib/sync';
 import { toast } from 'sonner';
 import { ArrowLeftRight, Check, X } from 'lucide-react';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -25,8 +26,8 @@ const ExchangesPage = ({ user }) => {
 
   const fetchExchanges = async () => {
     try {
-      const res = await axios.get(`${API}/exchanges`);
-      setExchanges(res.data);
+      const data = await syncedList('exchanges', '/exchanges');
+      setExchanges(data);
     } catch (error) {
       toast.error('Erreur lors du chargement');
     } finally {
@@ -36,9 +37,9 @@ const ExchangesPage = ({ user }) => {
 
   const fetchShifts = async () => {
     try {
-      const res = await axios.get(`${API}/shifts`);
+      const data = await syncedList('shifts', '/shifts');
       // Only show user's own validated/pending shifts
-      setShifts(res.data.filter(s => s.user_id === user.id && s.status !== 'paid'));
+      setShifts(data.filter(s => s.user_id === user.id && s.status !== 'paid'));
     } catch (error) {
       console.error('Error fetching shifts:', error);
     }
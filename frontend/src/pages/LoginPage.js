@@ -19,7 +19,7 @@ const LoginPage = ({ onLogin }) => {
 
     try {
       const res = await axios.post(`${API}/auth/login`, { email, password });
-      onLogin(res.data.access_token, res.data.user);
+      onLogin(res.data, res.data.user);
       toast.success('Connexion réussie!');
       navigate('/dashboard');
     } catch (error) {
@@ -2,6 +2,8 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { toast } from 'sonner';
 import { Send, MessageSquare } from 'lucide-react';
+import { subscribeEvents } from '@/lib/events';
+import { photoUrl } from '@/lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -20,8 +22,16 @@ const MessagesPage = ({ user }) => {
   useEffect(() => {
     if (selectedUser) {
       fetchMessages(selectedUser.id);
-      const interval = setInterval(() => fetchMessages(selectedUser.id), 5000);
-      return () => clearInterval(interval);
+      return subscribeEvents((type, data) => {
+        if (type === 'resync') {
+          fetchMessages(selectedUser.id);
+        } else if (type === 'message' && (data.sender_id === selectedUser.id || data.recipient_id === selectedUser.id)) {
+          setMessages(prev => prev.some(m => m.id === data.id) ? prev : [...prev, data]);
+          if (data.recipient_id === user.id && !data.read) {
+            axios.patch(`${API}/messages/${data.id}/read`).catch(() => {});
+          }
+        }
+      });
     }
   }, [selectedUser]);
 
@@ -101,7 +111,7 @@ const MessagesPage = ({ user }) => {
                 <div className="flex items-center gap-3">
                   <div className="w-10 h-10 rounded-full bg-gradient-to-br from-amber-100 to-yellow-100 flex items-center justify-center flex-shrink-0">
                     {u.photo ? (
-                      <img src={u.photo} alt={u.first_name} className="w-full h-full object-cover rounded-full" />
+                      <img src={photoUrl(u.photo_thumb || u.photo)} alt={u.first_name} className="w-full h-full object-cover rounded-full" />
                     ) : (
                       <span className="text-sm font-bold text-amber-600">
                         {u.first_name[0]}{u.last_name[0]}
@@ -127,7 +137,7 @@ const MessagesPage = ({ user }) => {
                 <div className="flex items-center gap-3">
                   <div className="w-12 h-12 rounded-full bg-gradient-to-br from-amber-100 to-yellow-100 flex items-center justify-center">
                     {selectedUser.photo ? (
-                      <img src={selectedUser.photo} alt={selectedUser.first_name} className="w-full h-full object-cover rounded-full" />
+                      <img src={photoUrl(selectedUser.photo_thumb || selectedUser.photo)} alt={selectedUser.first_name} className="w-full h-full object-cover rounded-full" />
                     ) : (
                       <span className="text-lg font-bold text-amber-600">
                         {selectedUser.first_name[0]}{selectedUser.last_name[0]}
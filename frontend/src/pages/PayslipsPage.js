@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
+import { syncedList } from '@/lib/sync';
 import { toast } from 'sonner';
 import { FileText, Download } from 'lucide-react';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -25,8 +26,8 @@ const PayslipsPage = ({ user }) => {
 
   const fetchPayslips = async () => {
     try {
-      const res = await axios.get(`${API}/payslips`);
-      setPayslips(res.data);
+      const data = await syncedList('payslips', '/payslips');
+      setPayslips(data);
     } catch (error) {
       toast.error('Erreur lors du chargement');
     } finally {
@@ -56,6 +57,20 @@ const PayslipsPage = ({ user }) => {
     }
   };
 
+  const handleDownload = async (payslip) => {
+    try {
+      const res = await axios.get(`${API}/payslips/${payslip.id}/pdf`, { responseType: 'blob' });
+      const url = URL.createObjectURL(res.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `fiche-de-paie-${payslip.period}.pdf`;
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      toast.error('Erreur lors du téléchargement');
+    }
+  };
+
   const getUserName = (id) => {
     if (id === user.id) return 'Vous';
     const u = users.find(u => u.id === id);
@@ -142,6 +157,15 @@ const PayslipsPage = ({ user }) => {
                     <h3 className="text-lg font-semibold text-gray-800">{getUserName(payslip.user_id)}</h3>
                     <p className="text-sm text-gray-600">Période: {payslip.period}</p>
                   </div>
+                  <Button
+                    variant="outline"
+                    size="sm"
+                    onClick={() => handleDownload(payslip)}
+                    data-testid={`payslip-download-${payslip.id}`}
+                  >
+                    <Download size={16} className="mr-1" />
+                    PDF
+                  </Button>
                 </div>
                 <div className="space-y-2 text-sm">
                   <div className="flex justify-between">
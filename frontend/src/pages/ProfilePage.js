@@ -2,6 +2,8 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { Camera, Save } from 'lucide-react';
 import { toast } from 'sonner';
+import { photoUrl } from '@/lib/utils';
+import { storeTokens } from '@/lib/auth';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -37,13 +39,19 @@ const ProfilePage = ({ user, setUser }) => {
 
     try {
       const updates = { ...formData };
-      if (photo) {
+      if (photo && photo !== user.photo) {
         updates.photo = photo;
       }
 
-      await axios.patch(`${API}/users/${user.id}`, updates);
+      const res = await axios.patch(`${API}/users/${user.id}`, updates);
+      // Changing the email or name revokes the old tokens; the server sends new ones
+      if (res.data.access_token) {
+        storeTokens(res.data);
+      }
       
-      const updatedUser = { ...user, ...updates };
+      // The server stores uploaded photos and returns their URLs
+      const updatedUser = { ...user, ...updates, ...(res.data.photo ? { photo: res.data.photo, photo_thumb: res.data.photo_thumb } : {}) };
+      setPhoto(updatedUser.photo);
       setUser(updatedUser);
       localStorage.setItem('user', JSON.stringify(updatedUser));
       
@@ -66,7 +74,7 @@ const ProfilePage = ({ user, setUser }) => {
             <div className="relative">
               <div className="w-32 h-32 rounded-full overflow-hidden bg-gradient-to-br from-amber-100 to-yellow-100 flex items-center justify-center">
                 {photo ? (
-                  <img src={photo} alt="Profile" className="w-full h-full object-cover" data-testid="profile-photo" />
+                  <img src={photoUrl(photo)} alt="Profile" className="w-full h-full object-cover" data-testid="profile-photo" />
                 ) : (
                   <span className="text-4xl font-bold text-amber-600">
                     {user.first_name[0]}{user.last_name[0]}
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
+import { syncedList } from '@/lib/sync';
 import { toast } from 'sonner';
 import { Plus, Calendar } from 'lucide-react';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -33,8 +34,8 @@ const SchedulesPage = ({ user }) => {
 
   const fetchSchedules = async () => {
     try {
-      const res = await axios.get(`${API}/schedules`);
-      setSchedules(res.data);
+      const data = await syncedList('schedules', '/schedules');
+      setSchedules(data);
     } catch (error) {
       toast.error('Erreur lors du chargement');
     } finally {
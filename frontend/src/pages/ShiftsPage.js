@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
+import { syncedList } from '@/lib/sync';
 import { toast } from 'sonner';
 import { Plus, Clock, DollarSign } from 'lucide-react';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -33,8 +34,8 @@ const ShiftsPage = ({ user }) => {
 
   const fetchShifts = async () => {
     try {
-      const res = await axios.get(`${API}/shifts`);
-      setShifts(res.data);
+      const data = await syncedList('shifts', '/shifts');
+      setShifts(data);
     } catch (error) {
       toast.error('Erreur lors du chargement');
     } finally {
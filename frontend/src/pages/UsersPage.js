@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import { toast } from 'sonner';
 import { Check, X, Search } from 'lucide-react';
+import { photoUrl } from '@/lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -117,7 +118,7 @@ const UsersPage = ({ user }) => {
               <div className="flex items-center gap-4">
                 <div className="w-16 h-16 rounded-full bg-gradient-to-br from-amber-100 to-yellow-100 flex items-center justify-center">
                   {u.photo ? (
-                    <img src={u.photo} alt={u.first_name} className="w-full h-full object-cover rounded-full" />
+                    <img src={photoUrl(u.photo_thumb || u.photo)} alt={u.first_name} className="w-full h-full object-cover rounded-full" />
                   ) : (
                     <span className="text-xl font-bold text-amber-600">
                       {u.first_name[0]}{u.last_name[0]}
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "sanacare_test")
+
+import server
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory stand-in for the Motor database (backend/requirements-dev.txt)"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    database = mongomock_motor.AsyncMongoMockClient()["sanacare_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
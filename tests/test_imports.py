@@ -0,0 +1,33 @@
+import io
+
+import pytest
+
+import server
+
+
+def json_rows(body):
+    return list(server._json_rows(io.StringIO(body)))
+
+
+def test_json_items_are_read_one_at_a_time():
+    assert json_rows(' [ 1 , {"a": [1, 2]}, "x,]" , 12345 ] \n') == [1, {"a": [1, 2]}, "x,]", 12345]
+
+
+@pytest.mark.parametrize("body", ["", "{}", "[1 2]", "[1,", "[1,]", "[1] x"])
+def test_malformed_json_is_rejected(body):
+    with pytest.raises(ValueError):
+        json_rows(body)
+
+
+def test_unreadable_tail_ends_the_chunk(monkeypatch):
+    monkeypatch.setattr(server, "BULK_CHUNK_SIZE", 5)
+    rows = server._json_rows(io.StringIO('[{"a": 1}, {"a": 2}, {"a": '))
+    chunk = server._next_rows(rows, "JSON")
+    assert chunk[:2] == [{"a": 1}, {"a": 2}]
+    assert isinstance(chunk[2], server.InvalidRow)
+    assert server._next_rows(rows, "JSON") == []
+
+
+def test_csv_rows_drop_empty_cells():
+    rows = server._csv_rows(io.StringIO("email, phone\nn1@x.com, \nn2@x.com,0600\n"))
+    assert list(rows) == [{"email": "n1@x.com"}, {"email": "n2@x.com", "phone": "0600"}]
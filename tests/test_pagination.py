@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException, Response
+from pymongo import ASCENDING, DESCENDING
+
+import server
+
+START = datetime(2026, 3, 2, tzinfo=timezone.utc)
+
+
+async def seed(db):
+    # Several rows share a created_at so pages have to break ties on id
+    docs = []
+    for i in range(7):
+        docs.append({
+            "id": f"shift-{i}", "user_id": "user-1" if i % 2 else "user-2",
+            "created_at": START + timedelta(minutes=i // 3)
+        })
+    await db.shifts.insert_many(docs)
+
+
+async def all_pages(db, query, limit, direction=ASCENDING):
+    ids = []
+    after = None
+    # A cursor that fails to move past its page would otherwise loop forever
+    for _ in range(20):
+        response = Response()
+        docs = await server.fetch_page(db.shifts, query, response, limit, after, direction=direction)
+        ids.extend(doc["id"] for doc in docs)
+        after = response.headers.get("X-Next-Cursor")
+        if not after:
+            return ids
+    raise AssertionError(f"Paging did not finish: {ids}")
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7, 10])
+def test_pages_cover_every_row_once_across_ties(db, limit):
+    async def scenario():
+        await seed(db)
+        return await all_pages(db, {}, limit)
+
+    assert asyncio.run(scenario()) == [f"shift-{i}" for i in range(7)]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3])
+def test_descending_pages_cover_every_row_once(db, limit):
+    async def scenario():
+        await seed(db)
+        return await all_pages(db, {}, limit, DESCENDING)
+
+    assert asyncio.run(scenario()) == [f"shift-{i}" for i in reversed(range(7))]
+
+
+def test_pages_keep_the_route_filter(db):
+    async def scenario():
+        await seed(db)
+        return await all_pages(db, {"$or": [{"user_id": "user-1"}, {"id": "shift-0"}]}, 2)
+
+    assert asyncio.run(scenario()) == ["shift-0", "shift-1", "shift-3", "shift-5"]
+
+
+def test_cursor_round_trips_dates():
+    cursor = server.encode_cursor([START, "shift-1"])
+    assert server.decode_cursor(cursor) == [START, "shift-1"]
+
+
+def test_malformed_cursor_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        server.decode_cursor("not-a-cursor")
+    assert error.value.status_code == 400
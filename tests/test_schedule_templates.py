@@ -0,0 +1,86 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import server
+
+MONDAY = datetime(2026, 3, 2, tzinfo=timezone.utc)
+
+
+def template(**fields):
+    doc = {
+        "id": str(uuid.uuid4()),
+        "user_id": "user-1",
+        "institution_id": "institution-1",
+        "weekdays": [0, 2],
+        "slots": [{"start_time": "08:00", "end_time": "16:00"}],
+        "starts_on": MONDAY,
+        "ends_on": None,
+        "exceptions": [],
+        "status": "available",
+        "expanded_until": MONDAY - timedelta(days=1),
+        "finished": False,
+    }
+    doc.update(fields)
+    return doc
+
+
+async def occurrence_days(db, template_id):
+    schedules = await db.schedules.find({"template_id": template_id}, {"_id": 0, "date": 1}).to_list(None)
+    return sorted(server.day_key(s["date"]) for s in schedules)
+
+
+def test_occurrences_include_both_bounds_and_skip_exceptions():
+    doc = template(exceptions=[MONDAY + timedelta(days=7)])
+    occurrences = server.template_occurrences(doc, MONDAY, MONDAY + timedelta(days=14))
+    assert [server.day_key(day) for day, _, _ in occurrences] == ["2026-03-02", "2026-03-04", "2026-03-11", "2026-03-16"]
+
+
+def test_occurrences_stop_at_ends_on():
+    doc = template(ends_on=MONDAY + timedelta(days=2))
+    occurrences = server.template_occurrences(doc, MONDAY, MONDAY + timedelta(days=30))
+    assert [server.day_key(day) for day, _, _ in occurrences] == ["2026-03-02", "2026-03-04"]
+
+
+def test_expanding_in_steps_leaves_no_gap_or_duplicate(db):
+    async def scenario():
+        doc = template()
+        await db.schedule_templates.insert_one(dict(doc))
+        await server.expand_template(doc, MONDAY + timedelta(days=9))
+        doc = await db.schedule_templates.find_one({"id": doc["id"]}, {"_id": 0})
+        await server.expand_template(doc, MONDAY + timedelta(days=20))
+        return await occurrence_days(db, doc["id"])
+
+    expected = [server.day_key(day) for day, _, _ in server.template_occurrences(template(), MONDAY, MONDAY + timedelta(days=20))]
+    assert asyncio.run(scenario()) == expected
+
+
+def test_concurrent_expansions_insert_each_day_once(db):
+    async def scenario():
+        doc = template()
+        await db.schedule_templates.insert_one(dict(doc))
+        until = MONDAY + timedelta(days=13)
+        inserted = await asyncio.gather(server.expand_template(doc, until), server.expand_template(doc, until))
+        return inserted, await occurrence_days(db, doc["id"])
+
+    inserted, days = asyncio.run(scenario())
+    assert sorted(inserted) == [0, 4]
+    assert days == ["2026-03-02", "2026-03-04", "2026-03-09", "2026-03-11"]
+
+
+def test_finished_template_leaves_the_horizon_scan(db, monkeypatch):
+    monkeypatch.setattr(server, "template_horizon_day", None)
+    today = server.utc_today()
+
+    async def scenario():
+        doc = template(starts_on=today, ends_on=today + timedelta(days=10), expanded_until=today - timedelta(days=1), weekdays=list(range(7)))
+        await db.schedule_templates.insert_one(dict(doc))
+        await server.extend_schedule_templates()
+        stored = await db.schedule_templates.find_one({"id": doc["id"]}, {"_id": 0})
+        pending = await db.schedule_templates.count_documents({"finished": {"$in": [False, None]}})
+        return stored, pending, await occurrence_days(db, doc["id"])
+
+    stored, pending, days = asyncio.run(scenario())
+    assert stored["finished"] is True
+    assert pending == 0
+    assert len(days) == 11
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+
+NURSE = server.User(
+    id="user-1", email="nurse@test.com", first_name="Marie", last_name="Dupont",
+    role="infirmier", status="approved", created_at=datetime(2026, 1, 1, tzinfo=timezone.utc)
+)
+
+
+async def seed(db, ages):
+    # One shift per entry; ages are seconds since the entry was written
+    now = datetime.now(timezone.utc)
+    for seq, age in enumerate(ages, start=1):
+        shift_id = f"shift-{seq}"
+        await db.shifts.insert_one({
+            "id": shift_id, "user_id": NURSE.id, "institution_id": "institution-1",
+            "date": datetime(2026, 3, 2, tzinfo=timezone.utc), "hours": 8.0, "hourly_rate": 25.0,
+            "travel_cost": 0.0, "total": 200.0, "status": "pending", "created_at": now
+        })
+        await db.sync_changes.insert_one({
+            "seq": seq, "type": "shifts", "id": shift_id, "users": [NURSE.id, server.SYNC_ADMINS],
+            "at": now - timedelta(seconds=age)
+        })
+
+
+def test_cursor_stops_before_the_first_unsettled_entry(db):
+    settled = server.SYNC_SETTLE_SECONDS + 10
+
+    async def scenario():
+        await seed(db, [settled, settled, 0, settled])
+        return await server.sync_changes_since(0, 10, NURSE)
+
+    page = asyncio.run(scenario())
+    assert page["cursor"] == 2
+    assert page["has_more"] is False
+    # Unsettled entries are still sent, and sent again from the cursor next time
+    assert [change["id"] for change in page["changes"]] == ["shift-1", "shift-2", "shift-3", "shift-4"]
+
+
+def test_full_page_of_settled_entries_has_more(db):
+    settled = server.SYNC_SETTLE_SECONDS + 10
+
+    async def scenario():
+        await seed(db, [settled, settled, settled])
+        return await server.sync_changes_since(0, 2, NURSE)
+
+    page = asyncio.run(scenario())
+    assert page["cursor"] == 2
+    assert page["has_more"] is True
+
+
+def test_full_page_that_cannot_advance_stops(db):
+    async def scenario():
+        await seed(db, [0, 0, 0])
+        return await server.sync_changes_since(0, 2, NURSE)
+
+    page = asyncio.run(scenario())
+    assert page["cursor"] == 0
+    assert page["has_more"] is False
+
+
+def test_entries_after_the_cursor_only(db):
+    settled = server.SYNC_SETTLE_SECONDS + 10
+
+    async def scenario():
+        await seed(db, [settled, settled, settled])
+        return await server.sync_changes_since(2, 10, NURSE)
+
+    page = asyncio.run(scenario())
+    assert page["cursor"] == 3
+    assert [change["id"] for change in page["changes"]] == ["shift-3"]